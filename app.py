@@ -1,12 +1,37 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Response, g, render_template, request, jsonify, redirect, url_for, flash, send_file, make_response
+from werkzeug.local import LocalProxy
 from database import Database
+from migrations import MIGRATIONS, LATEST_VERSION as LATEST_SCHEMA_VERSION
 from config import Config
-from code_generator import code_gen
+from code_generator import CodeGenerator, variant_kind
+from minifier import size_report
+from template_engine import CompiledTemplate, TemplateError, TemplateLibrary
+from fleet_bundle import FleetBundle, parse_id_list, select_devices
+from artifact_store import ArtifactStore
+from ingest_queue import IngestQueue, DURABILITY_FLUSH
+from background import PeriodicTask
+from latest_cache import LatestReadingCache
+from device_registry import DeviceRegistry
+from live_stream import LiveBroadcaster
+from stats_cache import DatabaseStatsCache
+from health import HealthProbe, RateLimiter
+from compression import compress_response, etag_variants
+import atexit
+import base64
+import click
+import csv
+import functools
+import hashlib
+import io
 import logging
 import json
 import os
-import tempfile
-from datetime import datetime
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -14,16 +39,223 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config.from_object(Config)
+app.after_request(compress_response)
+
+def create_app(config=None):
+    """Application factory: apply `config` (object or dict) and return the app
+    
+    Nothing here touches MySQL. Subsystems below are built on first use and
+    background jobs start with the first request (or an explicit warm_up()),
+    so they read app.config then, not at import. Routes are registered on the
+    module-level `app`: every call returns that same app, and config can only
+    be changed before it starts serving.
+    """
+    if config is not None:
+        if _services or _warm_up_started.is_set():
+            # subsystem ที่สร้างไปแล้วจะไม่เห็น config ใหม่ จึงไม่ยอมให้เปลี่ยนแบบเงียบๆ
+            raise RuntimeError("create_app(config) called after the app started serving; "
+                               "config must be applied before the first request")
+        if isinstance(config, dict):
+            app.config.update(config)
+        else:
+            app.config.from_object(config)
+    return app
+
+# Lazily built subsystems: each proxy creates its object on first access
+_services = {}
+_services_lock = threading.RLock()
+
+def lazy_service(factory):
+    """Replace `factory` with a proxy that builds factory() once, on first use"""
+    name = factory.__name__
+    
+    def get():
+        try:
+            return _services[name]
+        except KeyError:
+            with _services_lock:
+                if name not in _services:
+                    _services[name] = factory()
+                return _services[name]
+    
+    return LocalProxy(get)
+
+@lazy_service
+def db():
+    database = Database()
+    database.add_ingest_listener(live_broadcaster.publish)
+    database.add_ingest_listener(latest_cache.update)
+    database.add_ingest_listener(stats_cache.on_esp32_ingest)
+    database.add_device_listener(device_registry.invalidate)
+    database.add_template_listener(template_library.invalidate)
+    return database
+
+@lazy_service
+def template_library():
+    """Compiled code templates: program_templates rows over the built-in firmware_templates/ files"""
+    return TemplateLibrary(db, check_interval=app.config['TEMPLATE_CHECK_INTERVAL'])
+
+@lazy_service
+def code_gen():
+    """MicroPython generator with an LRU memo of generated artifacts"""
+    return CodeGenerator(app.config['CODEGEN_CACHE_SIZE'], template_library)
+
+@lazy_service
+def artifact_store():
+    """Generated code on disk, shared by all workers and kept across restarts (None when ARTIFACT_DIR is empty)"""
+    if not app.config['ARTIFACT_DIR']:
+        return None
+    try:
+        return ArtifactStore(app.config['ARTIFACT_DIR'], app.config['ARTIFACT_STORE_MAX_BYTES'])
+    except OSError as e:
+        # ไดเรกทอรีสร้าง/เขียนไม่ได้: ส่งโค้ดจากหน่วยความจำแทน (ผลลัพธ์ถูกเก็บไว้ ไม่ลองใหม่ทุก request)
+        logger.error(f"Artifact store disabled, cannot use {app.config['ARTIFACT_DIR']}: {e}")
+        return None
+
+@lazy_service
+def ingest_queue():
+    """Optional write-behind ingestion queue (None in direct mode)"""
+    if app.config['INGEST_MODE'] != 'write_behind':
+        return None
+    writer = IngestQueue(
+        db.insert_esp32_data_batch,
+        max_size=app.config['INGEST_QUEUE_SIZE'],
+        batch_size=app.config['INGEST_BATCH_SIZE'],
+        flush_interval=app.config['INGEST_FLUSH_INTERVAL']
+    )
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
+
+@lazy_service
+def live_broadcaster():
+    """Live stream viewers; rows written by other workers arrive through the latest cache resync"""
+    return LiveBroadcaster(app.config['SSE_MAX_CLIENTS'], app.config['SSE_CLIENT_BUFFER'])
 
-# Initialize database
-db = Database()
+@lazy_service
+def latest_cache():
+    """Latest reading per device, kept in memory and updated on every ingest"""
+    return LatestReadingCache()
 
-# Create tables on startup
-with app.app_context():
-    if db.create_tables():
-        logger.info("Database initialized successfully")
+@lazy_service
+def stats_cache():
+    """Database stats served from memory, reconciled with MySQL every STATS_TTL seconds"""
+    return DatabaseStatsCache(app.config['STATS_MODE'])
+
+@lazy_service
+def device_registry():
+    """esp32_devices cached in memory; invalidated on local writes, version-checked for other workers"""
+    return DeviceRegistry(db, app.config['DEVICE_REGISTRY_CHECK_INTERVAL'])
+
+@lazy_service
+def db_probe():
+    """Background database probe; readiness answers from its last result"""
+    return HealthProbe(db.ping, app.config['HEALTH_PROBE_MAX_AGE'])
+
+@lazy_service
+def diagnostics_limiter():
+    return RateLimiter(app.config['HEALTH_DIAGNOSTICS_INTERVAL'])
+
+def refresh_latest_cache():
+    if app.config['LATEST_CACHE_RESYNC_INTERVAL'] > 0 or not latest_cache.warmed:
+        return latest_cache.refresh(db, on_rows=live_broadcaster.publish)
+
+@lazy_service
+def background_tasks():
+    """Periodic jobs of this process keyed by name (started by warm_up())"""
+    tasks = [
+        PeriodicTask('esp32-latest-cache', refresh_latest_cache,
+                     app.config['LATEST_CACHE_RESYNC_INTERVAL'] or 30),
+        PeriodicTask('database-stats', lambda: stats_cache.refresh(db), app.config['STATS_TTL']),
+        PeriodicTask('db-health-probe', db_probe.run, app.config['HEALTH_PROBE_INTERVAL']),
+    ]
+    # Incremental rollup catch-up job (1m / 1h / 1d tables)
+    if app.config['ROLLUP_ENABLED'] and app.config['ROLLUP_INTERVAL'] > 0:
+        tasks.append(PeriodicTask('esp32-rollups', db.refresh_rollups, app.config['ROLLUP_INTERVAL']))
+    # Partition pre-creation and retention for esp32_data (no-op until the table is partitioned)
+    if app.config['PARTITION_MAINTENANCE_INTERVAL'] > 0:
+        tasks.append(PeriodicTask('esp32-partitions', db.maintain_esp32_partitions,
+                                  app.config['PARTITION_MAINTENANCE_INTERVAL']))
+    return {task.name: task for task in tasks}
+
+def check_schema_version():
+    """ตรวจ version ของ schema ครั้งเดียว (migration รันด้วย `flask --app app migrate`)"""
+    schema_version = db.get_schema_version()
+    if schema_version is None:
+        logger.error("Database unreachable, schema version unknown")
+    elif schema_version < LATEST_SCHEMA_VERSION:
+        if app.config['AUTO_MIGRATE']:
+            db.migrate()
+        else:
+            logger.warning(f"Database schema is at version {schema_version}, code expects "
+                           f"{LATEST_SCHEMA_VERSION}; run `flask --app app migrate`")
     else:
-        logger.error("Failed to initialize database")
+        logger.info(f"Database schema version {schema_version}")
+
+_warm_up_started = threading.Event()
+
+def warm_up():
+    """Start background jobs and the schema check without blocking the caller
+    
+    Safe to call more than once; returns True only for the call that did the work.
+    """
+    with _services_lock:
+        if _warm_up_started.is_set():
+            return False
+        _warm_up_started.set()
+    for task in background_tasks.values():
+        task.start()
+    threading.Thread(target=check_schema_version, name='schema-check', daemon=True).start()
+    return True
+
+def reset_after_fork():
+    """Forget subsystems inherited from a pre-fork parent (gunicorn post_fork hook)
+    
+    Threads do not survive fork and pooled sockets must not be shared, so the
+    child builds everything again on first use.
+    """
+    global _services_lock
+    database = _services.get('db')
+    if database is not None:
+        database.pool.reset()
+    _services.clear()
+    _services_lock = threading.RLock()
+    _warm_up_started.clear()
+
+def shutdown():
+    """Stop background jobs, flush the ingest queue and close pooled connections"""
+    tasks = _services.get('background_tasks') or {}
+    for task in tasks.values():
+        task.stop()
+    writer = _services.get('ingest_queue')
+    if writer is not None:
+        writer.stop()
+    database = _services.get('db')
+    if database is not None:
+        database.pool.close_all()
+
+# Startup budget: module import time + latency of the first request served
+startup_metrics = {'import_ms': None, 'first_request_ms': None,
+                   'budget_ms': None, 'within_budget': None}
+
+@app.before_request
+def start_request():
+    if not _warm_up_started.is_set() and warm_up():
+        g.first_request_started = time.perf_counter()
+
+@app.after_request
+def record_first_request(response):
+    started = g.pop('first_request_started', None)
+    if started is not None:
+        startup_metrics['first_request_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        # อ่านตอน request แรก ค่าจาก create_app(config) จึงมีผล
+        startup_metrics['budget_ms'] = app.config['STARTUP_BUDGET_MS']
+        total = startup_metrics['import_ms'] + startup_metrics['first_request_ms']
+        startup_metrics['within_budget'] = total <= startup_metrics['budget_ms']
+        log = logger.info if startup_metrics['within_budget'] else logger.warning
+        log(f"Startup: import {startup_metrics['import_ms']}ms + first request "
+            f"{startup_metrics['first_request_ms']}ms (budget {startup_metrics['budget_ms']}ms)")
+    return response
 
 @app.route('/')
 def home():
@@ -48,7 +280,7 @@ def data_history():
     """หน้าสำหรับดูประวัติข้อมูลทั้งหมด"""
     esp32_data = db.get_esp32_data(100)
     user_data = db.get_user_data(50) if hasattr(db, 'get_user_data') else []
-    stats = db.get_database_stats() if hasattr(db, 'get_database_stats') else {}
+    stats = stats_cache.get()
     
     return render_template('data_history.html', 
                          esp32_data=esp32_data, 
@@ -58,7 +290,7 @@ def data_history():
 @app.route('/manage-esp32')
 def manage_esp32():
     """หน้าจัดการ ESP32 Devices"""
-    devices = db.get_esp32_devices() if hasattr(db, 'get_esp32_devices') else []
+    devices = device_registry.get_esp32_devices()
     return render_template('manage_esp32.html', devices=devices)
 
 @app.route('/submit-data', methods=['POST'])
@@ -74,6 +306,7 @@ def submit_data():
     record_id = db.insert_user_data(data_from_input, client_ip)
     
     if record_id:
+        stats_cache.on_user_data_insert()
         logger.info(f"User data saved with ID: {record_id}")
         flash('บันทึกข้อมูลเรียบร้อยแล้ว!', 'success')
         status = "success"
@@ -87,6 +320,111 @@ def submit_data():
                          status=status,
                          record_id=record_id)
 
+SENSOR_FIELDS = ('temperature', 'humidity', 'light')
+
+def validate_esp32_reading(reading):
+    """ตรวจสอบข้อมูล sensor หนึ่งรายการ คืนข้อความ error หรือ None ถ้าถูกต้อง"""
+    if not isinstance(reading, dict) or not reading:
+        return "Reading must be a non-empty JSON object"
+    for field in SENSOR_FIELDS:
+        value = reading.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            return f"Field '{field}' must be a number"
+    return None
+
+def ingest_esp32_batch(readings):
+    """บันทึกข้อมูล ESP32 หลายรายการด้วย INSERT เดียว และรายงานผลทีละรายการ"""
+    max_size = app.config['ESP32_BATCH_MAX_SIZE']
+    if len(readings) > max_size:
+        return jsonify({
+            "status": "error",
+            "message": f"Batch too large: {len(readings)} readings (max {max_size})"
+        }), 413
+    
+    results = [None] * len(readings)
+    valid_indexes = []
+    for index, reading in enumerate(readings):
+        error = validate_esp32_reading(reading)
+        if error:
+            results[index] = {"index": index, "status": "error", "message": error}
+        else:
+            valid_indexes.append(index)
+    
+    record_ids = []
+    if valid_indexes:
+        record_ids = db.insert_esp32_data_batch([readings[i] for i in valid_indexes])
+    
+    db_failed = record_ids is None
+    for position, index in enumerate(valid_indexes):
+        if db_failed:
+            results[index] = {"index": index, "status": "error", "message": "Failed to save data"}
+        else:
+            results[index] = {"index": index, "status": "success", "record_id": record_ids[position]}
+    
+    inserted = 0 if db_failed else len(record_ids)
+    failed = len(readings) - inserted
+    if failed == 0:
+        status, http_status = "success", 200
+    elif inserted:
+        status, http_status = "partial", 200
+    else:
+        status, http_status = "error", 500 if db_failed else 400
+    
+    logger.info(f"📡 Received batch from gateway: {inserted}/{len(readings)} readings saved")
+    return jsonify({
+        "status": status,
+        "received": len(readings),
+        "inserted": inserted,
+        "failed": failed,
+        "first_id": record_ids[0] if inserted else None,
+        "last_id": record_ids[-1] if inserted else None,
+        "results": results,
+        "timestamp": datetime.now().isoformat()
+    }), http_status
+
+def enqueue_esp32_reading(data):
+    """ส่งข้อมูลเข้าคิว write-behind แล้วตอบกลับตาม durability mode"""
+    # ตรวจก่อนเข้าคิว: แถวที่ผิดรูปแบบจะทำให้ multi-row INSERT ของทั้ง batch ล้มเหลว
+    error = validate_esp32_reading(data)
+    if error:
+        return jsonify({"status": "error", "message": error, "received": data}), 400
+    
+    try:
+        pending = ingest_queue.submit(data)
+    except queue.Full:
+        return jsonify({
+            "status": "error",
+            "message": "Ingest queue is full, retry later"
+        }), 503
+    
+    if app.config['INGEST_DURABILITY'] != DURABILITY_FLUSH:
+        return jsonify({
+            "status": "accepted",
+            "message": "Data queued for saving",
+            "received": data,
+            "timestamp": datetime.now().isoformat()
+        }), 202
+    
+    if not pending.wait(app.config['INGEST_ACK_TIMEOUT']):
+        return jsonify({
+            "status": "accepted",
+            "message": "Data queued but not yet saved",
+            "received": data
+        }), 202
+    if pending.error:
+        return jsonify({
+            "status": "error",
+            "message": pending.error,
+            "received": data
+        }), 500
+    return jsonify({
+        "status": "success",
+        "message": "Data saved successfully",
+        "record_id": pending.record_id,
+        "received": data,
+        "timestamp": datetime.now().isoformat()
+    }), 200
+
 @app.route('/api/esp32/data', methods=['POST'])
 def api_esp32_data():
     try:
@@ -94,8 +432,15 @@ def api_esp32_data():
         if not data:
             return jsonify({"status": "error", "message": "No data received"}), 400
         
+        # gateway ส่งมาเป็น array ของ readings
+        if isinstance(data, list):
+            return ingest_esp32_batch(data)
+        
         logger.info(f"📡 Received from ESP32: {data}")
         
+        if ingest_queue:
+            return enqueue_esp32_reading(data)
+        
         # บันทึกลงฐานข้อมูล
         record_id = db.insert_esp32_data(data)
         
@@ -123,18 +468,220 @@ def api_esp32_data():
             "message": str(e)
         }), 400
 
+@app.route('/api/esp32/data/batch', methods=['POST'])
+def api_esp32_data_batch():
+    """API สำหรับรับข้อมูล ESP32 หลายรายการในครั้งเดียว (เช่นจาก gateway)"""
+    try:
+        data = request.json
+        readings = data.get('readings') if isinstance(data, dict) else data
+        if not isinstance(readings, list) or not readings:
+            return jsonify({
+                "status": "error",
+                "message": "Expected a non-empty JSON array of readings"
+            }), 400
+        
+        return ingest_esp32_batch(readings)
+        
+    except Exception as e:
+        logger.error(f"Error processing ESP32 batch: {e}")
+        return jsonify({
+            "status": "error", 
+            "message": str(e)
+        }), 400
+
+def esp32_data_version(device_id=None, cached=False):
+    """Validator for esp32_data reads: newest id + delete counter in MySQL, the same in every worker
+    
+    cached=True for views answered from latest_cache: while this worker's cache
+    has not caught up with the database, no validator is sent, so a stale body
+    never gets the ETag of the newer data.
+    """
+    version = db.get_esp32_data_version(device_id)
+    if version is None:
+        return None
+    max_id, deletes, last_modified = version
+    if cached and latest_cache.warmed and max_id > latest_cache.max_id:
+        return None
+    return f"{max_id}.{deletes}", last_modified
+
+def esp32_devices_version(*args, **kwargs):
+    """Validator for device list reads: change counter of esp32_devices"""
+    version = device_registry.current_version()
+    return (version, None) if version is not None else None
+
+def minify_options():
+    """อ่าน ?minify=1 / ?strip_prints=1 (ค่าเริ่มต้นจาก CODEGEN_MINIFY / CODEGEN_STRIP_PRINTS)
+    
+    Returns (minify, strip_prints); strip_prints implies minify.
+    """
+    def flag(name, default):
+        value = request.args.get(name)
+        return default if value is None else value.lower() in ('1', 'true', 'yes')
+    
+    strip_prints = flag('strip_prints', app.config['CODEGEN_STRIP_PRINTS'])
+    return flag('minify', app.config['CODEGEN_MINIFY']) or strip_prints, strip_prints
+
+def device_code_version(device_id):
+    """Validator for generated code: fingerprint of (device config, template text, generator version) + output variant"""
+    device = device_registry.get_device_by_id(device_id)
+    if not device:
+        return None
+    # เฉพาะ /api/devices/<id>/code รับ ?template= ส่วนหน้า download / uploader ใช้ template ของอุปกรณ์เสมอ
+    template_type = device['program_template']
+    if request.endpoint == 'api_generate_code':
+        template_type = request.args.get('template', template_type)
+    return f"{code_gen.fingerprint(device, template_type)}|{variant_kind('', *minify_options())}", None
+
+def conditional(validator, weak=True):
+    """ตอบ 304 Not Modified จาก validator ราคาถูก ก่อนรัน query หรือ serialize ข้อมูล
+    
+    validator(*view_args) คืน (version, last_modified) หรือ None (ไม่ทำ conditional GET)
+    ETag ผูกกับ URL + query string ดังนั้นแต่ละ filter/page มี ETag ของตัวเอง
+    ใช้ weak=False เฉพาะเมื่อ version กำหนด bytes ของ response ได้ทั้งหมด
+    If-Modified-Since (ละเอียดแค่วินาที) ใช้เฉพาะเมื่อไม่มี version ให้สร้าง ETag
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            validators = validator(*args, **kwargs)
+            if validators is None:
+                return view(*args, **kwargs)
+            
+            version, last_modified = validators
+            etag = None
+            if version is not None:
+                etag = hashlib.sha1(f"{request.full_path}|{version}".encode()).hexdigest()[:20]
+            if last_modified is not None:
+                # เวลาในฐานข้อมูลเป็น local time แบบ naive
+                last_modified = last_modified.astimezone(timezone.utc).replace(microsecond=0)
+            
+            matched_etag = None
+            if etag is None:
+                matched = (last_modified is not None and request.if_modified_since is not None
+                           and last_modified <= request.if_modified_since)
+            elif request.if_none_match:
+                # ETag ที่ client ถืออยู่อาจเป็นของ response ที่ถูกบีบอัด ("<etag>-gzip" / "<etag>-br")
+                matched_etag = next((variant for variant in etag_variants(etag)
+                                     if request.if_none_match.contains_weak(variant)), None)
+                matched = matched_etag is not None
+            else:
+                # เขียนข้อมูลในวินาทีเดียวกันไม่ทำให้ Last-Modified เปลี่ยน จึงไม่ตอบ 304 จาก If-Modified-Since
+                matched = False
+            
+            if etag is not None:
+                g.etag = etag
+            response = Response(status=304) if matched else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                # 304 ส่ง ETag เดียวกับ 200 ที่ client มีอยู่ (compress_response ไม่แตะ 304)
+                if etag is not None:
+                    response.set_etag(matched_etag if matched and matched_etag else etag, weak=weak)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def encode_page_cursor(row):
+    """สร้าง cursor แบบ opaque จากตำแหน่ง (timestamp, id) ของแถว"""
+    raw = f"{row['timestamp'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_page_cursor(token):
+    """แปลง cursor กลับเป็น (timestamp, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        timestamp, record_id = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(record_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {token}")
+
+def parse_time_param(name):
+    """อ่าน query parameter เวลา (ISO 8601 หรือ epoch seconds)"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        if value.isdigit():
+            return datetime.fromtimestamp(int(value))
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' time: {value}")
+    if parsed.tzinfo:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+RESPONSE_FORMATS = ('rows', 'columnar')
+COLUMNAR_FIELDS = ('id', 'device_id', 'temperature', 'humidity', 'light')
+
+def parse_response_format():
+    """อ่าน ?format= (rows เป็นค่าเริ่มต้น, columnar = array แยกตาม field)"""
+    response_format = request.args.get('format', 'rows')
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unsupported format '{response_format}', use one of {', '.join(RESPONSE_FORMATS)}")
+    return response_format
+
+def to_columns(rows, fields, time_field='timestamp'):
+    """Pivot rows into parallel arrays per field; time_field becomes epoch seconds"""
+    columns = {time_field: [int(row[time_field].timestamp()) for row in rows]}
+    for field in fields:
+        columns[field] = [row[field] for row in rows]
+    return columns
+
 @app.route('/api/esp32/data', methods=['GET'])
+@conditional(lambda: esp32_data_version(request.args.get('device')))
 def get_esp32_data():
-    """API สำหรับดึงข้อมูล ESP32"""
+    """API สำหรับดึงข้อมูล ESP32 แบบแบ่งหน้าด้วย cursor
+    
+    ?limit=50&device=X&from=...&to=...&before=<cursor> หรือ &after=<cursor>
+    ใช้ next_cursor เป็น before เพื่อดูข้อมูลที่เก่ากว่า และ prev_cursor เป็น after เพื่อดูข้อมูลใหม่กว่า
+    """
     try:
         limit = request.args.get('limit', 50, type=int)
-        data = db.get_esp32_data(limit)
+        limit = min(max(limit, 1), app.config['ESP32_PAGE_MAX_LIMIT'])
+        before_token = request.args.get('before')
+        after_token = request.args.get('after')
+        if before_token and after_token:
+            return jsonify({
+                "status": "error",
+                "message": "Use either 'before' or 'after', not both"
+            }), 400
         
-        return jsonify({
+        try:
+            before = decode_page_cursor(before_token) if before_token else None
+            after = decode_page_cursor(after_token) if after_token else None
+            start = parse_time_param('from')
+            end = parse_time_param('to')
+            response_format = parse_response_format()
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        
+        columnar = response_format == 'columnar'
+        data, has_more = db.get_esp32_data_page(
+            limit,
+            device_id=request.args.get('device'),
+            before=before,
+            after=after,
+            start=start,
+            end=end,
+            include_raw=not columnar
+        )
+        if data is None:
+            return jsonify({"status": "error", "message": "Failed to fetch data"}), 500
+        
+        response = {
             "status": "success",
             "count": len(data),
-            "data": data
-        }), 200
+            "has_more": has_more,
+            "next_cursor": encode_page_cursor(data[-1]) if data and (has_more or after) else None,
+            "prev_cursor": encode_page_cursor(data[0]) if data else None
+        }
+        if columnar:
+            response["format"] = "columnar"
+            response["columns"] = to_columns(data, COLUMNAR_FIELDS)
+        else:
+            response["data"] = data
+        return jsonify(response), 200
         
     except Exception as e:
         logger.error(f"Error fetching ESP32 data: {e}")
@@ -143,11 +690,203 @@ def get_esp32_data():
             "message": str(e)
         }), 500
 
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+EXPORT_CSV_FIELDS = ('id', 'device_id', 'timestamp', 'temperature', 'humidity', 'light', 'raw_data')
+
+def export_json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def encode_export_batch(rows, export_format):
+    """แปลงข้อมูลหนึ่ง batch เป็นข้อความ NDJSON หรือ CSV"""
+    if export_format == 'ndjson':
+        return ''.join(
+            json.dumps(row, default=export_json_default, ensure_ascii=False) + '\n' for row in rows
+        )
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            row['id'],
+            row['device_id'],
+            row['timestamp'].isoformat() if row['timestamp'] else '',
+            row['temperature'],
+            row['humidity'],
+            row['light'],
+            json.dumps(row['raw_data'], ensure_ascii=False)
+        ])
+    return buffer.getvalue()
+
+@app.route('/api/esp32/export')
+def api_esp32_export():
+    """Stream ESP32 history as NDJSON or CSV without loading it into memory
+    
+    ?format=ndjson|csv&device=X&from=...&to=...
+    """
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({
+            "status": "error",
+            "message": f"Unsupported format: {export_format} (use ndjson or csv)"
+        }), 400
+    
+    try:
+        start = parse_time_param('from')
+        end = parse_time_param('to')
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    batches = db.iter_esp32_data(
+        device_id=request.args.get('device'),
+        start=start,
+        end=end,
+        batch_size=app.config['EXPORT_BATCH_SIZE']
+    )
+    try:
+        # เริ่ม query ก่อนส่ง header เพื่อให้ตอบ 500 ได้ถ้าฐานข้อมูลมีปัญหา
+        first_batch = next(batches, None)
+    except Exception as e:
+        logger.error(f"Error starting ESP32 export: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    
+    def generate():
+        if export_format == 'csv':
+            yield ','.join(EXPORT_CSV_FIELDS) + '\r\n'
+        batch = first_batch
+        row_count = 0
+        try:
+            while batch is not None:
+                row_count += len(batch)
+                yield encode_export_batch(batch, export_format)
+                batch = next(batches, None)
+            logger.info(f"ESP32 export finished: {row_count} rows")
+        except Exception as e:
+            logger.error(f"ESP32 export aborted after {row_count} rows: {e}")
+        finally:
+            batches.close()
+    
+    filename = f"esp32_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(
+        generate(),
+        mimetype=EXPORT_MIMETYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SERIES_BUCKETS = (60, 300, 900, 3600, 6 * 3600, 86400)
+SERIES_METRICS = ('temperature', 'humidity', 'light')
+SERIES_COLUMNS = ('bucket', 'count') + tuple(
+    f'{metric}_{stat}' for metric in SERIES_METRICS for stat in ('min', 'max', 'avg'))
+
+def parse_bucket(value):
+    """แปลงขนาด bucket เช่น '30s', '5m', '1h', '1d' เป็นวินาที"""
+    value = value.strip().lower()
+    try:
+        seconds = int(value[:-1]) * BUCKET_UNITS[value[-1]] if value[-1] in BUCKET_UNITS else int(value)
+    except (ValueError, IndexError):
+        raise ValueError(f"Invalid bucket: {value} (use e.g. 30s, 5m, 1h, 1d)")
+    if seconds <= 0:
+        raise ValueError(f"Invalid bucket: {value}")
+    return seconds
+
+def format_bucket(seconds):
+    for unit, size in sorted(BUCKET_UNITS.items(), key=lambda item: -item[1]):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+
+@app.route('/api/esp32/series')
+def api_esp32_series():
+    """Time-bucketed min/max/avg/count for charts
+    
+    ?device=X&from=...&to=...&bucket=5m (default: last 24 hours, bucket chosen
+    so the chart gets about SERIES_TARGET_POINTS points), &format=columnar for
+    parallel arrays
+    """
+    try:
+        response_format = parse_response_format()
+        end = parse_time_param('to') or datetime.now()
+        start = parse_time_param('from') or end - timedelta(days=1)
+        if start >= end:
+            raise ValueError("'from' must be earlier than 'to'")
+        
+        span = (end - start).total_seconds()
+        if request.args.get('bucket'):
+            bucket_seconds = parse_bucket(request.args['bucket'])
+        else:
+            target = app.config['SERIES_TARGET_POINTS']
+            bucket_seconds = next((b for b in SERIES_BUCKETS if span / b <= target), SERIES_BUCKETS[-1])
+        
+        max_points = app.config['SERIES_MAX_POINTS']
+        if span / bucket_seconds > max_points:
+            raise ValueError(f"Too many buckets ({int(span // bucket_seconds)}), "
+                             f"use a larger bucket (max {max_points} points)")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    try:
+        device_id = request.args.get('device')
+        rows = db.get_esp32_series(start, end, bucket_seconds, device_id=device_id)
+        if rows is None:
+            return jsonify({"status": "error", "message": "Failed to fetch series"}), 500
+        
+        points = []
+        for row in rows:
+            point = {
+                "bucket": int(row['bucket']),
+                "timestamp": datetime.fromtimestamp(int(row['bucket'])).isoformat(),
+                "count": int(row['count'])
+            }
+            for metric in SERIES_METRICS:
+                for stat in ('min', 'max', 'avg'):
+                    value = row[f'{metric}_{stat}']
+                    point[f'{metric}_{stat}'] = round(float(value), 2) if value is not None else None
+            points.append(point)
+        
+        response = {
+            "status": "success",
+            "device": device_id,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "bucket": format_bucket(bucket_seconds),
+            "bucket_seconds": bucket_seconds,
+            "count": len(points)
+        }
+        if response_format == 'columnar':
+            # bucket เป็น epoch seconds อยู่แล้ว ไม่ต้องส่ง timestamp แบบ ISO ซ้ำ
+            response["format"] = "columnar"
+            response["columns"] = {key: [point[key] for point in points] for key in SERIES_COLUMNS}
+        else:
+            response["points"] = points
+        return jsonify(response), 200
+        
+    except Exception as e:
+        logger.error(f"Error fetching ESP32 series: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+def get_latest_reading(device_id=None):
+    """ข้อมูลล่าสุดจาก cache (ใช้ฐานข้อมูลเฉพาะตอนที่ cache ยังโหลดไม่เสร็จ)"""
+    if latest_cache.warmed:
+        return latest_cache.get(device_id) if device_id else latest_cache.latest()
+    if device_id:
+        data = db.get_esp32_data(1, sensor_id=device_id)
+        return data[0] if data else None
+    return db.get_latest_esp32_data()
+
 @app.route('/api/esp32/latest')
-def api_esp32_latest():
-    """API สำหรับดึงข้อมูลล่าสุดจาก ESP32"""
+@app.route('/api/esp32/latest/<device_id>')
+@conditional(lambda device_id=None: esp32_data_version(device_id or request.args.get('device'), cached=True))
+def api_esp32_latest(device_id=None):
+    """API สำหรับดึงข้อมูลล่าสุดจาก ESP32 (ทั้งหมด หรือเฉพาะอุปกรณ์)"""
     try:
-        data = db.get_latest_esp32_data() if hasattr(db, 'get_latest_esp32_data') else None
+        data = get_latest_reading(device_id or request.args.get('device'))
         
         if data:
             return jsonify({
@@ -167,48 +906,149 @@ def api_esp32_latest():
             "message": str(e)
         }), 500
 
-@app.route('/api/health')
-def health_check():
-    """Health check endpoint"""
-    try:
-        connection = db.get_connection()
-        if connection:
-            # Test database query
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT 1")
-                cursor.fetchone()
-            connection.close()
-            
-            # Get database stats
-            stats = db.get_database_stats() if hasattr(db, 'get_database_stats') else {}
-            
-            return jsonify({
-                "status": "healthy",
-                "database": "connected",
-                "timestamp": datetime.now().isoformat(),
-                "stats": stats
-            }), 200
+@app.route('/api/esp32/fleet/latest')
+@conditional(lambda: esp32_data_version(cached=True))
+def api_esp32_fleet_latest():
+    """API สำหรับดึงข้อมูลล่าสุดของทุกอุปกรณ์"""
+    try:
+        if latest_cache.warmed:
+            devices = list(latest_cache.all().values())
         else:
-            return jsonify({
-                "status": "unhealthy",
-                "database": "disconnected",
-                "timestamp": datetime.now().isoformat()
-            }), 503
+            devices = db.get_latest_esp32_per_device() or []
+        devices.sort(key=lambda reading: reading['device_id'] or '')
+        
+        return jsonify({
+            "status": "success",
+            "count": len(devices),
+            "devices": devices
+        }), 200
+        
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
+        logger.error(f"Error fetching fleet latest data: {e}")
         return jsonify({
-            "status": "unhealthy",
-            "database": "error",
-            "error": str(e),
-            "timestamp": datetime.now().isoformat()
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/api/esp32/stream')
+def api_esp32_stream():
+    """Server-Sent Events: push new ESP32 readings as they are ingested
+    
+    Query: device (optional) - only stream readings from this device
+    (device_id is accepted as an alias)
+    """
+    device_id = request.args.get('device') or request.args.get('device_id') or None
+    subscription = live_broadcaster.subscribe(device_id)
+    if subscription is None:
+        return jsonify({
+            "status": "error",
+            "message": "Too many live stream clients, try again later"
         }), 503
+    
+    heartbeat = app.config['SSE_HEARTBEAT_INTERVAL']
+    
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            yield from subscription.events(heartbeat)
+        finally:
+            live_broadcaster.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/ingest/stats')
+def api_ingest_stats():
+    """สถิติของคิว write-behind (queue depth, flush latency)"""
+    if not ingest_queue:
+        return jsonify({"status": "success", "mode": app.config['INGEST_MODE']}), 200
+    return jsonify({
+        "status": "success",
+        "mode": app.config['INGEST_MODE'],
+        "durability": app.config['INGEST_DURABILITY'],
+        "queue": ingest_queue.stats()
+    }), 200
+
+def background_task_stats():
+    return {name: task.stats() for name, task in background_tasks.items()}
+
+@app.route('/api/health')
+def health_check():
+    """Health check endpoint (answers from the background probe, no DB query)"""
+    probe = db_probe.snapshot()
+    ready = db_probe.ready()
+    response = {
+        "status": "healthy" if ready else "unhealthy",
+        "database": "connected" if ready else "disconnected",
+        "timestamp": datetime.now().isoformat(),
+        "probe": probe,
+        "stats": stats_cache.get(),
+        "pool": db.get_pool_stats()
+    }
+    if not ready and probe['last_error']:
+        response["error"] = probe['last_error']
+    return jsonify(response), 200 if ready else 503
+
+@app.route('/api/health/live')
+def health_live():
+    """Liveness: the process is up and serving requests (never touches the DB)"""
+    return jsonify({
+        "status": "alive",
+        "timestamp": datetime.now().isoformat()
+    }), 200
+
+@app.route('/api/health/ready')
+def health_ready():
+    """Readiness: last background DB probe passed recently"""
+    ready = db_probe.ready()
+    return jsonify({
+        "status": "ready" if ready else "not_ready",
+        "timestamp": datetime.now().isoformat(),
+        "database": db_probe.snapshot(),
+        "pool": db.get_pool_stats()
+    }), 200 if ready else 503
+
+@app.route('/api/health/diagnostics')
+def health_diagnostics():
+    """Detailed diagnostics with a live DB check (rate limited)"""
+    allowed, retry_after = diagnostics_limiter.allow()
+    if not allowed:
+        response = jsonify({
+            "status": "error",
+            "message": "Diagnostics are rate limited",
+            "retry_after": round(retry_after, 1)
+        })
+        response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+        return response, 429
+    
+    db_probe.run()
+    ready = db_probe.ready()
+    return jsonify({
+        "status": "healthy" if ready else "unhealthy",
+        "timestamp": datetime.now().isoformat(),
+        "database": db_probe.snapshot(),
+        "pool": db.get_pool_stats(),
+        "stats": stats_cache.get(),
+        "latest_cache": latest_cache.stats(),
+        "device_registry": device_registry.stats(),
+        "code_generator": code_gen.stats(),
+        "artifact_store": artifact_store.stats() if artifact_store else None,
+        "live_stream": live_broadcaster.stats(),
+        "schema_version": db.get_schema_version(),
+        "startup": startup_metrics,
+        "ingest": ingest_queue.stats() if ingest_queue else {"mode": app.config['INGEST_MODE']},
+        "tasks": background_task_stats()
+    }), 200 if ready else 503
 
 # ESP32 Device Management API Routes
 @app.route('/api/esp32/devices', methods=['GET'])
+@conditional(esp32_devices_version)
 def api_get_esp32_devices():
     """API สำหรับดึงรายการ ESP32 devices"""
     try:
-        devices = db.get_esp32_devices()
+        devices = device_registry.get_esp32_devices()
         return jsonify({
             "status": "success",
             "count": len(devices),
@@ -264,7 +1104,7 @@ def api_add_esp32_device():
 def api_get_esp32_device(device_id):
     """API สำหรับดึงข้อมูล ESP32 device เฉพาะ"""
     try:
-        device = db.get_esp32_device(device_id)
+        device = device_registry.get_esp32_device(device_id)
         
         if device:
             return jsonify(device), 200
@@ -310,6 +1150,41 @@ def api_update_esp32_device(device_id):
             "message": str(e)
         }), 500
 
+@app.route('/api/templates/<int:template_id>', methods=['PUT'])
+def api_update_program_template(template_id):
+    """API สำหรับแก้ไข program template (เฉพาะ field ที่ส่งมา)"""
+    try:
+        data = request.json
+        if not data:
+            return jsonify({"status": "error", "message": "No data received"}), 400
+        
+        if data.get('code_template'):
+            # ตรวจว่า template compile ได้ก่อนบันทึก ไม่ให้อุปกรณ์ที่ใช้ template นี้ดาวน์โหลดโค้ดไม่ได้
+            try:
+                CompiledTemplate(data.get('template_name', str(template_id)), data['code_template'])
+            except TemplateError as e:
+                return jsonify({"status": "error", "message": str(e)}), 400
+        
+        success = db.update_program_template(template_id, data)
+        
+        if success:
+            return jsonify({
+                "status": "success",
+                "message": "Template updated successfully"
+            }), 200
+        else:
+            return jsonify({
+                "status": "error",
+                "message": "Failed to update template or template not found"
+            }), 404
+            
+    except Exception as e:
+        logger.error(f"Error updating program template: {e}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @app.route('/api/esp32/devices/<device_id>', methods=['DELETE'])
 def api_delete_esp32_device(device_id):
     """API สำหรับลบ ESP32 device"""
@@ -415,7 +1290,7 @@ def api_add_esp32_program():
 def device_management():
     """Device management page"""
     try:
-        devices = db.get_devices()
+        devices = device_registry.get_devices()
         templates = db.get_program_templates()
         return render_template('device_management.html', devices=devices, templates=templates)
     except Exception as e:
@@ -467,7 +1342,7 @@ def add_device():
 def device_details(device_id):
     """View device details and generated code"""
     try:
-        device = db.get_device_by_id(device_id)
+        device = device_registry.get_device_by_id(device_id)
         if not device:
             flash("Device not found", 'error')
             return redirect(url_for('device_management'))
@@ -482,69 +1357,68 @@ def device_details(device_id):
         flash(f"Error loading device: {e}", 'error')
         return redirect(url_for('device_management'))
 
+def send_generated_code(kind, device, filename, render):
+    """ส่งไฟล์โค้ดจาก artifact store (render เฉพาะเมื่อยังไม่มีใน store) รองรับ Range / If-Range
+    
+    ถ้า store ใช้ไม่ได้ จะ render แล้วส่งจากหน่วยความจำแทน
+    """
+    options = dict(mimetype='text/x-python', as_attachment=True, download_name=filename,
+                   etag=g.get('etag', False), conditional=True, max_age=None)
+    try:
+        if artifact_store:
+            key = f"{kind}-{code_gen.fingerprint(device, device['program_template'])}"
+            return send_file(artifact_store.get_or_create(key, render), **options)
+    except OSError as e:
+        logger.warning(f"Artifact store unavailable, sending {kind} from memory: {e}")
+    return send_file(io.BytesIO(render().encode()), **options)
+
 @app.route('/devices/<int:device_id>/download')
+@conditional(device_code_version, weak=False)
 def download_device_code(device_id):
     """Download generated code for device"""
     try:
-        device = db.get_device_by_id(device_id)
+        device = device_registry.get_device_by_id(device_id)
         if not device:
             return jsonify({"error": "Device not found"}), 404
         
-        # Generate code
-        generated_code = code_gen.generate_code(device, device['program_template'])
-        
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False)
-        temp_file.write(generated_code)
-        temp_file.close()
-        
         filename = f"{device['device_name']}_main.py"
         
-        response = send_file(temp_file.name, as_attachment=True, download_name=filename)
-        response.call_on_close(lambda: os.unlink(temp_file.name))
-        
-        return response
+        minify, strip_prints = minify_options()
+        return send_generated_code(variant_kind('main', minify, strip_prints), device, filename,
+                                   lambda: code_gen.generate_code(device, device['program_template'],
+                                                                  minify, strip_prints))
         
     except Exception as e:
         logger.error(f"Error downloading code: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/devices/<int:device_id>/uploader')
+@conditional(device_code_version, weak=False)
 def download_uploader(device_id):
     """Download Python uploader script"""
     try:
-        device = db.get_device_by_id(device_id)
+        device = device_registry.get_device_by_id(device_id)
         if not device:
             return jsonify({"error": "Device not found"}), 404
         
-        # Generate device code
-        device_code = code_gen.generate_code(device, device['program_template'])
-        
-        # Generate uploader script
-        uploader_code = code_gen.generate_python_uploader(device, device_code)
-        
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False)
-        temp_file.write(uploader_code)
-        temp_file.close()
-        
         filename = f"{device['device_name']}_uploader.py"
         
-        response = send_file(temp_file.name, as_attachment=True, download_name=filename)
-        response.call_on_close(lambda: os.unlink(temp_file.name))
-        
-        return response
+        minify, strip_prints = minify_options()
+        return send_generated_code(variant_kind('uploader', minify, strip_prints), device, filename,
+                                   lambda: code_gen.generate_uploader(device, device['program_template'],
+                                                                      minify, strip_prints))
         
     except Exception as e:
         logger.error(f"Error downloading uploader: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/devices', methods=['GET'])
+@conditional(esp32_devices_version)
 def api_get_devices():
     """API endpoint to get all devices"""
     try:
         device_type = request.args.get('type')
-        devices = db.get_devices(device_type)
+        devices = device_registry.get_devices(device_type)
         return jsonify({
             "status": "success",
             "devices": devices,
@@ -554,29 +1428,165 @@ def api_get_devices():
         logger.error(f"Error getting devices: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def make_fleet_bundle(devices, minify=False, strip_prints=False):
+    return FleetBundle(
+        devices, code_gen, template_library.export_rows(),
+        workers=app.config['FLEET_BUILD_WORKERS'],
+        parallel_min=app.config['FLEET_BUILD_PARALLEL_MIN'],
+        minify=minify, strip_prints=strip_prints
+    )
+
+@app.route('/api/devices/bundle')
+def api_device_bundle():
+    """ZIP of main.py + uploader.py for every matching device, streamed while it is built
+    
+    Filters: ?type=ESP32&template=basic_sensor&ids=1,2,3 (all optional)
+    Output: ?minify=1 / ?strip_prints=1 as for single downloads
+    """
+    try:
+        ids = parse_id_list(request.args.get('ids'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    try:
+        devices = select_devices(device_registry.get_esp32_devices(),
+                                 request.args.get('type'), request.args.get('template'), ids)
+        if not devices:
+            return jsonify({"status": "error", "message": "No devices match the filter"}), 404
+        
+        bundle = make_fleet_bundle(devices, *minify_options())
+        response = Response(bundle.chunks(), mimetype='application/zip')
+        response.headers['Content-Disposition'] = 'attachment; filename=fleet_bundle.zip'
+        response.headers['X-Device-Count'] = str(len(devices))
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error building device bundle: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/devices/<int:device_id>/code')
+@conditional(device_code_version, weak=False)
 def api_generate_code(device_id):
     """API endpoint to generate code for device"""
     try:
-        device = db.get_device_by_id(device_id)
+        device = device_registry.get_device_by_id(device_id)
         if not device:
             return jsonify({"error": "Device not found"}), 404
         
         template_type = request.args.get('template', device['program_template'])
-        generated_code = code_gen.generate_code(device, template_type)
+        minify, strip_prints = minify_options()
+        generated_code = code_gen.generate_code(device, template_type, minify, strip_prints)
         
-        return jsonify({
+        result = {
             "status": "success",
             "device_name": device['device_name'],
             "device_type": device['device_type'],
             "template": template_type,
             "code": generated_code
-        })
+        }
+        if minify:
+            result["minified"] = size_report(code_gen.generate_code(device, template_type), generated_code)
+        return jsonify(result)
         
     except Exception as e:
         logger.error(f"Error generating code: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.cli.command('backfill-device-ids')
+@click.option('--batch-size', default=10000, show_default=True, help='Rows per UPDATE range')
+def backfill_device_ids_command(batch_size):
+    """Copy raw_data.sensor_id into the indexed esp32_data.device_id column"""
+    updated = db.migrate_device_identity(batch_size)
+    if updated is None:
+        raise click.ClickException("Backfill failed, see the log for details")
+    click.echo(f"Updated {updated} rows")
+
+@app.cli.command('refresh-rollups')
+def refresh_rollups_command():
+    """Fold all pending esp32_data rows into the rollup tables"""
+    while True:
+        result = db.refresh_rollups()
+        if result is None:
+            raise click.ClickException("Rollup refresh failed, see the log for details")
+        if result['to_id'] > result['from_id']:
+            click.echo(f"Processed IDs {result['from_id'] + 1}-{result['to_id']}")
+        if result['caught_up']:
+            break
+
+@app.cli.command('migrate')
+@click.option('--to', 'target', type=int, default=None, help='Stop at this schema version')
+@click.option('--list', 'list_only', is_flag=True, help='Show migrations and their state, apply nothing')
+def migrate_command(target, list_only):
+    """Apply pending schema migrations"""
+    current = db.get_schema_version()
+    if current is None:
+        raise click.ClickException("Database unreachable")
+    if list_only:
+        for version, description, _ in MIGRATIONS:
+            state = 'applied' if version <= current else 'pending'
+            click.echo(f"{version:>4}  {state:<8} {description}")
+        return
+    
+    applied = db.migrate(target)
+    if applied is None:
+        raise click.ClickException("Migration failed, see the log for details")
+    click.echo(f"Applied: {', '.join(map(str, applied)) or 'nothing'} "
+               f"(schema version {db.get_schema_version()})")
+
+@app.cli.command('build-bundle')
+@click.option('--type', 'device_type', default=None, help='Only this device type (ESP32, PICO_WH, ...)')
+@click.option('--template', default=None, help='Only devices using this program template')
+@click.option('--ids', default=None, help='Comma-separated device IDs')
+@click.option('--workers', type=int, default=None, help='Render processes (default FLEET_BUILD_WORKERS)')
+@click.option('--minify', is_flag=True, help='Strip comments, docstrings and indentation from main.py')
+@click.option('--strip-prints', is_flag=True, help='Also drop print() diagnostics (implies --minify)')
+@click.option('-o', '--output', default='fleet_bundle.zip', show_default=True, help='ZIP file to write')
+def build_bundle_command(device_type, template, ids, workers, minify, strip_prints, output):
+    """Write main.py + uploader.py for matching devices into one ZIP archive"""
+    try:
+        ids = parse_id_list(ids)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--ids')
+    
+    devices = select_devices(device_registry.get_esp32_devices(), device_type, template, ids)
+    if not devices:
+        raise click.ClickException("No devices match the filter")
+    
+    bundle = make_fleet_bundle(devices, minify or strip_prints, strip_prints)
+    if workers is not None:
+        bundle.workers = workers
+    with open(output, 'wb') as f:
+        for chunk in bundle.chunks():
+            f.write(chunk)
+    
+    report = bundle.report
+    click.echo(f"Wrote {report['devices']} devices to {output} in {report['total_ms']} ms "
+               f"({report['workers'] or 'no'} worker processes, {report['build_ms']} ms rendering)")
+    if report['minified']:
+        sizes = report['minified']
+        click.echo(f"main.py total {sizes['original_bytes']} -> {sizes['minified_bytes']} bytes "
+                   f"({sizes['saved_bytes']} saved)")
+    for entry in sorted(report['entries'], key=lambda entry: entry['build_ms'], reverse=True)[:5]:
+        click.echo(f"{entry['build_ms']:>10.3f} ms  {entry['device_name']} ({entry['template']})")
+
+@app.cli.command('partition-esp32-data')
+def partition_esp32_data_command():
+    """Convert esp32_data to daily/monthly RANGE partitions (rebuilds the table)"""
+    if not db.partition_esp32_data():
+        raise click.ClickException("Partitioning failed, see the log for details")
+    click.echo("esp32_data is partitioned")
+
+@app.cli.command('maintain-partitions')
+def maintain_partitions_command():
+    """Create upcoming esp32_data partitions and drop expired ones"""
+    result = db.maintain_esp32_partitions()
+    if result is None:
+        raise click.ClickException("Nothing done: table not partitioned, lock busy or error (see log)")
+    click.echo(f"Created: {', '.join(result['created']) or '-'}")
+    click.echo(f"Dropped: {', '.join(result['dropped']) or '-'}")
+
+startup_metrics['import_ms'] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 2)
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
@@ -0,0 +1,195 @@
+"""
+Content-addressed artifact store for generated code
+Blobs live under objects/<aa>/<sha256 of content>; refs/<key> maps a build key
+(kind + code fingerprint) to the blob, so a download needs no render once any
+worker has built that artifact, also after a restart. Files are written to tmp/
+and moved into place with os.replace(), so readers never see a partial file.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DIGEST_LENGTH = 64  # sha256 hex
+TOUCH_INTERVAL = 60  # seconds; a hit refreshes the blob mtime (LRU clock) at most this often
+RESCAN_INTERVAL = 60  # seconds; re-read the size on disk to count other workers' writes
+
+
+class ArtifactStore:
+    """Size-bounded on-disk store shared by every worker process
+
+    When the blobs exceed `max_bytes`, the least recently used ones (by
+    mtime) are deleted down to 90% of the limit. Refs whose blob is gone are
+    treated as misses and removed. Each process adds its own writes to the
+    size and re-scans the directory every `rescan_interval` seconds to pick
+    up the writes of the others.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, rescan_interval=RESCAN_INTERVAL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        self._objects = os.path.join(directory, 'objects')
+        self._refs = os.path.join(directory, 'refs')
+        self._tmp = os.path.join(directory, 'tmp')
+        for path in (self._objects, self._refs, self._tmp):
+            os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk as last seen by this process
+        self._scanned_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+
+    def blob_path(self, digest):
+        return os.path.join(self._objects, digest[:2], digest)
+
+    def _ref_path(self, key):
+        return os.path.join(self._refs, key)
+
+    def _write_atomic(self, path, data, sync=False):
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def lookup(self, key):
+        """Path of the blob stored under `key`, or None"""
+        try:
+            with open(self._ref_path(key)) as f:
+                digest = f.read()
+        except FileNotFoundError:
+            return None
+        if len(digest) != DIGEST_LENGTH:
+            return None
+
+        path = self.blob_path(digest)
+        try:
+            if time.time() - os.stat(path).st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except FileNotFoundError:
+            # blob ถูก evict ไปแล้ว
+            self._remove(self._ref_path(key))
+            return None
+        return path
+
+    def put(self, key, data):
+        """Store `data` (bytes) under `key`; identical content shares one blob"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        try:
+            # blob เดิมที่ถูกใช้ซ้ำนับเป็นการใช้งานล่าสุด ไม่ให้ถูก evict เป็นตัวถัดไป
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write_atomic(path, data, sync=True)
+            with self._lock:
+                self.writes += 1
+                if self._size is not None:
+                    self._size += len(data)
+        self._write_atomic(self._ref_path(key), digest.encode())
+
+        if self._disk_size() > self.max_bytes:
+            self.evict()
+        return path
+
+    def get_or_create(self, key, render):
+        """Path of the artifact for `key`, calling render() (str or bytes) only on a miss"""
+        path = self.lookup(key)
+        if path is not None:
+            with self._lock:
+                self.hits += 1
+            return path
+
+        with self._lock:
+            self.misses += 1
+        data = render()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return self.put(key, data)
+
+    def _blobs(self):
+        for root, _, names in os.walk(self._objects):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _disk_size(self):
+        """Bytes in objects/; re-scanned when older than rescan_interval (other workers write too)"""
+        if self._size is None or time.monotonic() - self._scanned_at > self.rescan_interval:
+            size = sum(size for _, size, _ in self._blobs())
+            with self._lock:
+                self._size = size
+                self._scanned_at = time.monotonic()
+        return self._size
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def evict(self):
+        """Delete least recently used blobs until the store is under 90% of max_bytes"""
+        blobs = sorted(self._blobs(), key=lambda blob: blob[2])
+        total = sum(size for _, size, _ in blobs)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for path, size, _ in blobs:
+            if total <= target:
+                break
+            if self._remove(path):
+                removed += 1
+            total -= size
+
+        if removed:
+            # ลบ ref ที่ชี้ไปยัง blob ที่ไม่มีแล้ว
+            for name in os.listdir(self._refs):
+                ref = self._ref_path(name)
+                try:
+                    with open(ref) as f:
+                        digest = f.read()
+                except FileNotFoundError:
+                    continue
+                if not os.path.exists(self.blob_path(digest)):
+                    self._remove(ref)
+            logger.info(f"Artifact store evicted {removed} blobs, {total} bytes remain")
+
+        with self._lock:
+            self._size = total
+            self._scanned_at = time.monotonic()
+            self.evicted += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evicted': self.evicted,
+            }
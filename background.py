@@ -0,0 +1,77 @@
+"""
+Background helpers
+Runs maintenance jobs (rollups, caches, probes) on a fixed interval in a daemon thread
+"""
+
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Call `func` every `interval` seconds in a daemon thread until stop()"""
+
+    def __init__(self, name, func, interval, run_immediately=True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.run_immediately = run_immediately
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration_ms = None
+        self.last_error = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"Background task '{self.name}' started (every {self.interval}s)")
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self):
+        """รันงานหนึ่งครั้งทันที (ใช้ได้ทั้งจาก thread และจาก CLI)"""
+        started = time.monotonic()
+        try:
+            result = self.func()
+            self.last_error = None
+            return result
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.error(f"Background task '{self.name}' failed: {e}")
+            return None
+        finally:
+            self.runs += 1
+            self.last_run = time.time()
+            self.last_duration_ms = round((time.monotonic() - started) * 1000, 2)
+
+    def _loop(self):
+        if not self.run_immediately and self._stop.wait(self.interval):
+            return
+        while not self._stop.is_set():
+            self.run_once()
+            if self._stop.wait(self.interval):
+                break
+
+    def stats(self):
+        return {
+            'running': bool(self._thread and self._thread.is_alive()),
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_run': self.last_run,
+            'last_duration_ms': self.last_duration_ms,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,123 @@
+"""
+Response compression
+Negotiates br/gzip from Accept-Encoding and compresses JSON, HTML, CSV and
+NDJSON responses; streamed (generator) responses are compressed chunk by chunk
+"""
+
+import zlib
+import logging
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ENCODINGS = ('br', 'gzip')
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/json', 'application/javascript', 'application/x-ndjson',
+}
+
+
+class GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStream:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def etag_variants(etag):
+    """ETag of a response and of its compressed forms ("<etag>-br", "<etag>-gzip")"""
+    return [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]
+
+
+def choose_encoding():
+    """เลือก encoding ตาม Accept-Encoding ของ client (br ก่อน gzip ถ้าติดตั้ง brotli)"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def make_stream(encoding):
+    config = current_app.config
+    if encoding == 'br':
+        return BrotliStream(config['COMPRESS_BR_QUALITY'])
+    return GzipStream(config['COMPRESS_LEVEL'])
+
+
+def compress_chunks(chunks, stream):
+    """Compress an iterable of chunks, flushing after each so clients see data as it is produced"""
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                yield stream.compress(chunk) + stream.flush()
+        yield stream.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+
+def compress_response(response):
+    """after_request hook: compress the response body if the client accepts it"""
+    config = current_app.config
+    if not config['COMPRESS_ENABLED'] or request.method == 'HEAD':
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code < 200 or response.status_code in (204, 206, 304) or \
+            'Content-Encoding' in response.headers or response.direct_passthrough:
+        return response
+
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, make_stream(encoding))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        stream = make_stream(encoding)
+        response.set_data(stream.compress(data) + stream.finish())
+
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # bytes ต่างจาก representation เดิม: ETag แบบ strong ต้องแยกตาม encoding
+        response.set_etag(f"{etag}-{encoding}")
+    return response
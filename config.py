@@ -12,6 +12,67 @@ class Config:
     MYSQL_DB = 'iot_webapp'
     MYSQL_CHARSET = 'utf8mb4'
     
+    # Connection Pool Configuration
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))  # per worker process: MySQL sees workers x this
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))  # seconds to wait for a free connection
+    DB_POOL_IDLE_TIMEOUT = int(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300))
+    DB_POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME', 3600))
+    DB_POOL_PING_INTERVAL = int(os.environ.get('DB_POOL_PING_INTERVAL', 30))  # ping idle connections older than this
+    
+    # ESP32 Ingestion Configuration
+    ESP32_BATCH_MAX_SIZE = int(os.environ.get('ESP32_BATCH_MAX_SIZE', 1000))  # readings per batch request
+    ESP32_INSERT_CHUNK_SIZE = int(os.environ.get('ESP32_INSERT_CHUNK_SIZE', 500))  # rows per INSERT statement
+    ESP32_PAGE_MAX_LIMIT = int(os.environ.get('ESP32_PAGE_MAX_LIMIT', 1000))  # max rows per GET page
+    SERIES_MAX_POINTS = int(os.environ.get('SERIES_MAX_POINTS', 5000))  # max buckets per series request
+    SERIES_TARGET_POINTS = int(os.environ.get('SERIES_TARGET_POINTS', 300))  # used when bucket is omitted
+    LATEST_CACHE_RESYNC_INTERVAL = int(os.environ.get('LATEST_CACHE_RESYNC_INTERVAL', 5))  # pick up other workers' rows, 0 = off
+    # Each viewer holds a gunicorn thread; the default leaves half of GUNICORN_THREADS for normal requests
+    SSE_MAX_CLIENTS = int(os.environ.get('SSE_MAX_CLIENTS', max(1, int(os.environ.get('GUNICORN_THREADS', 8)) // 2)))  # concurrent live stream viewers per process
+    SSE_CLIENT_BUFFER = int(os.environ.get('SSE_CLIENT_BUFFER', 500))  # queued events per viewer before it is dropped
+    SSE_HEARTBEAT_INTERVAL = int(os.environ.get('SSE_HEARTBEAT_INTERVAL', 15))  # seconds between keepalive comments
+    DEVICE_REGISTRY_CHECK_INTERVAL = float(os.environ.get('DEVICE_REGISTRY_CHECK_INTERVAL', 2))  # seconds between table version checks
+    CODEGEN_CACHE_SIZE = int(os.environ.get('CODEGEN_CACHE_SIZE', 256))  # generated artifacts kept in the LRU memo, 0 = off
+    CODEGEN_MINIFY = os.environ.get('CODEGEN_MINIFY', 'false').lower() == 'true'  # default for ?minify= on code downloads
+    CODEGEN_STRIP_PRINTS = os.environ.get('CODEGEN_STRIP_PRINTS', 'false').lower() == 'true'  # default for ?strip_prints=
+    TEMPLATE_CHECK_INTERVAL = float(os.environ.get('TEMPLATE_CHECK_INTERVAL', 5))  # seconds between program_templates version checks
+    FLEET_BUILD_WORKERS = int(os.environ.get('FLEET_BUILD_WORKERS', os.cpu_count() or 1))  # render processes for fleet bundles, 0 = in-process
+    FLEET_BUILD_PARALLEL_MIN = int(os.environ.get('FLEET_BUILD_PARALLEL_MIN', 200))  # smaller bundles are rendered in-process
+    ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'artifacts'))  # generated code store, '' = off
+    ARTIFACT_STORE_MAX_BYTES = int(os.environ.get('ARTIFACT_STORE_MAX_BYTES', 256 * 1024 * 1024))  # LRU eviction above this size
+    STATS_MODE = os.environ.get('STATS_MODE', 'exact')  # 'exact' (background COUNT) or 'approximate'
+    STATS_TTL = int(os.environ.get('STATS_TTL', 300))  # seconds between background stats refreshes
+    HEALTH_PROBE_INTERVAL = int(os.environ.get('HEALTH_PROBE_INTERVAL', 5))  # seconds between background DB probes
+    HEALTH_PROBE_MAX_AGE = int(os.environ.get('HEALTH_PROBE_MAX_AGE', 30))  # older probe results mean not ready
+    HEALTH_DIAGNOSTICS_INTERVAL = int(os.environ.get('HEALTH_DIAGNOSTICS_INTERVAL', 10))  # min seconds between diagnostics calls
+    ROLLUP_ENABLED = os.environ.get('ROLLUP_ENABLED', 'true').lower() == 'true'  # read series from rollup tables
+    ROLLUP_INTERVAL = int(os.environ.get('ROLLUP_INTERVAL', 30))  # seconds between catch-up runs, 0 = off
+    ROLLUP_BATCH_ROWS = int(os.environ.get('ROLLUP_BATCH_ROWS', 50000))  # max IDs folded per run
+    ESP32_PARTITION_GRANULARITY = os.environ.get('ESP32_PARTITION_GRANULARITY', 'day')  # 'day' or 'month'
+    ESP32_PARTITIONS_AHEAD = int(os.environ.get('ESP32_PARTITIONS_AHEAD', 7))  # periods created in advance
+    ESP32_RETENTION_DAYS = int(os.environ.get('ESP32_RETENTION_DAYS', 0))  # drop older raw data, 0 = keep all
+    PARTITION_MAINTENANCE_INTERVAL = int(os.environ.get('PARTITION_MAINTENANCE_INTERVAL', 3600))  # 0 = off
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))  # rows per streamed chunk
+    EXPORT_NET_WRITE_TIMEOUT = int(os.environ.get('EXPORT_NET_WRITE_TIMEOUT', 600))
+    
+    # Write-behind ingestion ('direct' = INSERT per request, 'write_behind' = background batches)
+    INGEST_MODE = os.environ.get('INGEST_MODE', 'direct')
+    INGEST_DURABILITY = os.environ.get('INGEST_DURABILITY', 'enqueue')  # 'enqueue' or 'flush'
+    INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+    INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', 1.0))  # seconds
+    INGEST_ACK_TIMEOUT = float(os.environ.get('INGEST_ACK_TIMEOUT', 10))  # max wait in 'flush' mode
+    
+    # Response compression (gzip, plus brotli when the 'brotli' package is installed)
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true'
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))  # gzip 1 (fast) - 9 (smallest)
+    COMPRESS_BR_QUALITY = int(os.environ.get('COMPRESS_BR_QUALITY', 4))  # brotli 0 - 11
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))  # bytes; smaller bodies are sent as-is
+    
+    # Apply pending schema migrations at startup instead of requiring `flask migrate`
+    AUTO_MIGRATE = os.environ.get('AUTO_MIGRATE', 'false').lower() == 'true'
+    
+    STARTUP_BUDGET_MS = int(os.environ.get('STARTUP_BUDGET_MS', 1000))  # import + first request, warn above this
+    
     # Flask Configuration
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-change-this'
     DEBUG = True
\ No newline at end of file
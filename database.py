@@ -1,33 +1,300 @@
 import pymysql
+from pymysql.constants import ER
 from config import Config
+from db_pool import ConnectionPool
+from migrations import MIGRATIONS
 import logging
 import json
+import time
+from datetime import date, datetime, timedelta
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+ESP32_INSERT_SQL = """
+    INSERT INTO esp32_data (temperature, humidity, light, device_id, raw_data, timestamp)
+    VALUES """
+ESP32_INSERT_ROW = "(%s, %s, %s, %s, %s, %s)"
+
+DEFAULT_DEVICE_ID = 'ESP32_DEFAULT'
+DEVICE_ID_MAX_LENGTH = 100
+
+def normalize_device_id(data):
+    """หา identity ของอุปกรณ์จากข้อมูลที่ส่งมา
+    
+    firmware จาก code_generator ส่ง `sensor_id` ส่วน client อื่นส่ง `device_id`
+    ทั้งสองแบบถูกเก็บลงคอลัมน์ device_id (มี index) เพื่อให้ query รายอุปกรณ์ไม่ต้องอ่าน JSON
+    """
+    for key in ('device_id', 'sensor_id'):
+        value = data.get(key)
+        if value is not None:
+            value = str(value).strip()[:DEVICE_ID_MAX_LENGTH]
+            if value:
+                return value
+    return DEFAULT_DEVICE_ID
+
+def esp32_record(data, timestamp, record_id=None):
+    """ข้อมูลหนึ่งแถวของ esp32_data ในรูปแบบเดียวกับ format_esp32_row"""
+    return {
+        'id': record_id,
+        'device_id': normalize_device_id(data),
+        'temperature': data.get('temperature'),
+        'humidity': data.get('humidity'),
+        'light': data.get('light'),
+        'raw_data': data,
+        'timestamp': timestamp
+    }
+
+def esp32_row_params(record):
+    """แปลง record เป็นค่าสำหรับหนึ่งแถวใน INSERT ของ esp32_data"""
+    return (
+        record['temperature'],
+        record['humidity'],
+        record['light'],
+        record['device_id'],
+        json.dumps(record['raw_data']),
+        record['timestamp']
+    )
+
+def local_utc_offset():
+    """UTC offset ของเครื่อง app เช่น '+07:00' สำหรับตั้ง time_zone ของ MySQL session"""
+    offset = time.strftime('%z')
+    return f"{offset[:3]}:{offset[3:]}"
+
+# Rollup tables, coarsest first: (suffix, bucket size in seconds)
+ROLLUP_LEVELS = (('1d', 86400), ('1h', 3600), ('1m', 60))
+ROLLUP_METRICS = ('temperature', 'humidity', 'light')
+ROLLUP_STATE_NAME = 'esp32_data'
+
+def _rollup_upsert_sql(suffix):
+    """INSERT ... SELECT ที่รวมข้อมูลช่วง id ใหม่เข้ากับ bucket เดิมในตาราง rollup"""
+    columns = ['count']
+    selects = ['COUNT(*)']
+    updates = ['count = count + VALUES(count)']
+    for metric in ROLLUP_METRICS:
+        columns += [f'{metric}_count', f'{metric}_sum', f'{metric}_min', f'{metric}_max']
+        selects += [f'COUNT({metric})', f'SUM({metric})', f'MIN({metric})', f'MAX({metric})']
+        updates += [
+            f'{metric}_count = {metric}_count + VALUES({metric}_count)',
+            f'{metric}_sum = IFNULL({metric}_sum, 0) + IFNULL(VALUES({metric}_sum), 0)',
+            f'{metric}_min = LEAST(IFNULL({metric}_min, VALUES({metric}_min)), '
+            f'IFNULL(VALUES({metric}_min), {metric}_min))',
+            f'{metric}_max = GREATEST(IFNULL({metric}_max, VALUES({metric}_max)), '
+            f'IFNULL(VALUES({metric}_max), {metric}_max))',
+        ]
+    return f"""
+        INSERT INTO esp32_rollup_{suffix} (device_id, bucket, {', '.join(columns)})
+        SELECT IFNULL(device_id, '{DEFAULT_DEVICE_ID}'), UNIX_TIMESTAMP(timestamp) DIV %s * %s AS bucket,
+               {', '.join(selects)}
+        FROM esp32_data
+        WHERE id > %s AND id <= %s
+        GROUP BY 1, 2
+        ON DUPLICATE KEY UPDATE {', '.join(updates)}
+    """
+
+def _rollup_series_sql(suffix, device_filter):
+    """Series query over a rollup table plus raw rows the rollup does not cover
+    
+    Rollup buckets are read for the aligned range [lo, hi) only; raw rows fill
+    in the part of [start, end) before lo and from hi on (start / end not on a
+    rollup boundary) and rows inside [lo, hi) past the rollup watermark.
+    """
+    device_condition = "device_id = %s AND " if device_filter else ""
+    rollup_columns = ['count']
+    raw_columns = ['1']
+    aggregates = ['SUM(count) AS count']
+    for metric in ROLLUP_METRICS:
+        rollup_columns += [f'{metric}_count', f'{metric}_sum', f'{metric}_min', f'{metric}_max']
+        raw_columns += [f'{metric} IS NOT NULL', metric, metric, metric]
+        aggregates += [
+            f'MIN({metric}_min) AS {metric}_min',
+            f'MAX({metric}_max) AS {metric}_max',
+            f'SUM({metric}_sum) / NULLIF(SUM({metric}_count), 0) AS {metric}_avg',
+        ]
+    return f"""
+        SELECT period DIV %s * %s AS bucket, {', '.join(aggregates)}
+        FROM (
+            SELECT bucket AS period, {', '.join(rollup_columns)}
+            FROM esp32_rollup_{suffix}
+            WHERE {device_condition}bucket >= %s AND bucket < %s
+            UNION ALL
+            SELECT UNIX_TIMESTAMP(timestamp), {', '.join(raw_columns)}
+            FROM esp32_data
+            WHERE id > (SELECT last_id FROM esp32_rollup_state WHERE name = '{ROLLUP_STATE_NAME}')
+              AND {device_condition}timestamp >= FROM_UNIXTIME(%s) AND timestamp < FROM_UNIXTIME(%s)
+            UNION ALL
+            SELECT UNIX_TIMESTAMP(timestamp), {', '.join(raw_columns)}
+            FROM esp32_data
+            WHERE {device_condition}timestamp >= %s AND timestamp < %s AND timestamp < FROM_UNIXTIME(%s)
+            UNION ALL
+            SELECT UNIX_TIMESTAMP(timestamp), {', '.join(raw_columns)}
+            FROM esp32_data
+            WHERE {device_condition}timestamp >= %s AND timestamp < %s AND timestamp >= FROM_UNIXTIME(%s)
+        ) AS combined
+        GROUP BY 1
+        ORDER BY 1
+    """
+
+PARTITION_FUTURE = 'p_future'
+PARTITION_LOCK = 'esp32_partition_maintenance'
+MIGRATION_LOCK = 'schema_migrations'
+
+def partition_period(day, granularity):
+    """คืน (ชื่อ partition, วันเริ่ม, วันเริ่มของ partition ถัดไป) ของช่วงที่มี `day`"""
+    if granularity == 'month':
+        start = day.replace(day=1)
+        return f"p{start:%Y%m}", start, (start + timedelta(days=32)).replace(day=1)
+    return f"p{day:%Y%m%d}", day, day + timedelta(days=1)
+
+def partition_upper_bound(name):
+    """วันเริ่มของ partition ถัดไป (ขอบบนแบบไม่รวม) จากชื่อ pYYYYMMDD / pYYYYMM"""
+    if len(name) == 9:
+        return partition_period(datetime.strptime(name[1:], '%Y%m%d').date(), 'day')[2]
+    return partition_period(datetime.strptime(name[1:], '%Y%m').date(), 'month')[2]
+
+def partition_definition(name, upper):
+    return f"PARTITION {name} VALUES LESS THAN (UNIX_TIMESTAMP('{upper:%Y-%m-%d} 00:00:00'))"
+
+def esp32_filters(device_id=None, start=None, end=None):
+    """เงื่อนไข WHERE ของ esp32_data ตามอุปกรณ์และช่วงเวลา (start รวม, end ไม่รวม)"""
+    conditions = []
+    params = []
+    if device_id:
+        conditions.append("device_id = %s")
+        params.append(device_id)
+    if start:
+        conditions.append("timestamp >= %s")
+        params.append(start)
+    if end:
+        conditions.append("timestamp < %s")
+        params.append(end)
+    return conditions, params
+
+def format_esp32_row(row):
+    """แปลงแถวจาก esp32_data (DictCursor) เป็น dict สำหรับ API/template"""
+    raw_data = row['raw_data']
+    return {
+        'id': row['id'],
+        'device_id': row['device_id'],
+        'temperature': row['temperature'],
+        'humidity': row['humidity'],
+        'light': row['light'],
+        'raw_data': json.loads(raw_data) if raw_data else {},
+        'timestamp': row['timestamp']
+    }
+
+DEVICE_JSON_FIELDS = ('pin_config', 'sensor_config')
+
+def decode_device_row(row):
+    """แปลง pin_config / sensor_config ของแถว esp32_devices จาก JSON เป็น dict"""
+    for field in DEVICE_JSON_FIELDS:
+        if field not in row:
+            continue
+        value = row[field]
+        if isinstance(value, (str, bytes)):
+            try:
+                value = json.loads(value)
+            except (json.JSONDecodeError, TypeError):
+                value = None
+        row[field] = value or {}
+    return row
+
 class Database:
     def __init__(self):
         self.config = Config()
+        self.pool = ConnectionPool(
+            self._connect,
+            max_size=self.config.DB_POOL_SIZE,
+            timeout=self.config.DB_POOL_TIMEOUT,
+            idle_timeout=self.config.DB_POOL_IDLE_TIMEOUT,
+            max_lifetime=self.config.DB_POOL_MAX_LIFETIME,
+            ping_interval=self.config.DB_POOL_PING_INTERVAL
+        )
+        self._ingest_listeners = []
+        self._device_listeners = []
+        self._template_listeners = []
     
-    def get_connection(self):
-        """สร้างการเชื่อมต่อฐานข้อมูล MySQL"""
+    def _connect(self):
+        """เปิดการเชื่อมต่อ MySQL ใหม่ (ใช้โดย connection pool)"""
+        return pymysql.connect(
+            host=self.config.MYSQL_HOST,
+            port=self.config.MYSQL_PORT,
+            user=self.config.MYSQL_USER,
+            password=self.config.MYSQL_PASSWORD,
+            database=self.config.MYSQL_DB,
+            charset=self.config.MYSQL_CHARSET,
+            cursorclass=pymysql.cursors.DictCursor,
+            autocommit=False,
+            # timestamp ถูกกำหนดจากฝั่ง app จึงให้ session ใช้ time zone เดียวกับ app
+            init_command=f"SET time_zone = '{local_utc_offset()}'"
+        )
+    
+    def get_connection(self, exclusive=False):
+        """ยืมการเชื่อมต่อฐานข้อมูล MySQL จาก connection pool
+        
+        เรียก connection.close() เพื่อคืนการเชื่อมต่อกลับเข้า pool
+        exclusive=True จะได้ connection แยกที่ไม่ใช้ร่วมกับการเรียกซ้อนใน thread เดียวกัน
+        """
         try:
-            connection = pymysql.connect(
-                host=self.config.MYSQL_HOST,
-                port=self.config.MYSQL_PORT,
-                user=self.config.MYSQL_USER,
-                password=self.config.MYSQL_PASSWORD,
-                database=self.config.MYSQL_DB,
-                charset=self.config.MYSQL_CHARSET,
-                cursorclass=pymysql.cursors.DictCursor,
-                autocommit=False
-            )
-            return connection
+            return self.pool.acquire(exclusive=exclusive)
         except Exception as e:
             logger.error(f"Database connection error: {e}")
             return None
     
+    def add_ingest_listener(self, callback):
+        """ลงทะเบียน callback(records) ที่ถูกเรียกหลังบันทึกข้อมูล ESP32 สำเร็จ (หลัง commit)"""
+        self._ingest_listeners.append(callback)
+    
+    def _notify_ingest(self, records):
+        for callback in self._ingest_listeners:
+            try:
+                callback(records)
+            except Exception as e:
+                logger.error(f"Ingest listener {callback!r} failed: {e}")
+    
+    def add_device_listener(self, callback):
+        """ลงทะเบียน callback() ที่ถูกเรียกหลังข้อมูลใน esp32_devices เปลี่ยน (หลัง commit)"""
+        self._device_listeners.append(callback)
+    
+    def _notify_device_change(self):
+        for callback in self._device_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Device listener {callback!r} failed: {e}")
+    
+    def add_template_listener(self, callback):
+        """ลงทะเบียน callback() ที่ถูกเรียกหลังข้อมูลใน program_templates เปลี่ยน (หลัง commit)"""
+        self._template_listeners.append(callback)
+    
+    def _notify_template_change(self):
+        for callback in self._template_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Template listener {callback!r} failed: {e}")
+    
+    def ping(self):
+        """ตรวจสอบว่าฐานข้อมูลตอบสนอง (SELECT 1)"""
+        connection = self.get_connection()
+        if not connection:
+            return False
+        
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            return True
+        except Exception as e:
+            logger.error(f"Database ping failed: {e}")
+            return False
+        finally:
+            connection.close()
+    
+    def get_pool_stats(self):
+        """สถิติของ connection pool (in use, idle, waits, wait time)"""
+        return self.pool.stats()
+    
     def create_database_if_not_exists(self):
         """สร้างฐานข้อมูลถ้าไม่มี"""
         try:
@@ -52,49 +319,84 @@ class Database:
             return False
     
     def create_tables(self):
-        """Create all required tables"""
+        """Bring the schema up to date (kept for setup scripts, same as migrate())"""
+        return self.migrate() is not None
+    
+    def get_schema_version(self):
+        """Highest applied migration (0 if none), None if the database is unreachable"""
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
         try:
-            connection = self.get_connection()
-            cursor = connection.cursor()
-            
-            # Create users table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(100) NOT NULL,
-                    email VARCHAR(100) UNIQUE NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Create esp32_data table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS esp32_data (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    device_id VARCHAR(100) DEFAULT 'ESP32_DEFAULT',
-                    temperature FLOAT,
-                    humidity FLOAT,
-                    light FLOAT,
-                    raw_data JSON,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    INDEX idx_device_timestamp (device_id, timestamp),
-                    INDEX idx_timestamp (timestamp)
-                )
-            """)
-            
-            connection.commit()
-            
-            # Create device management tables
-            self.create_device_tables()
-            
-            logging.info("All tables created successfully")
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT MAX(version) AS version FROM schema_migrations")
+                return cursor.fetchone()['version'] or 0
+        except pymysql.err.ProgrammingError as e:
+            if e.args[0] == ER.NO_SUCH_TABLE:
+                return 0
+            logger.error(f"Error reading schema version: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Error reading schema version: {e}")
+            return None
+        finally:
+            connection.close()
+    
+    def migrate(self, target=None):
+        """ใช้ migration ที่ยังไม่ได้ใช้ตามลำดับ (ถึง version `target` ถ้าระบุ)
+        
+        DDL ของ MySQL commit เองทีละคำสั่ง จึงบันทึก version หลังแต่ละ migration
+        และทุก migration ต้องรันซ้ำได้อย่างปลอดภัย ใช้ GET_LOCK กันหลาย process รันพร้อมกัน
+        Returns the list of applied versions, or None on failure.
+        """
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        locked = False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, %s) AS locked", (MIGRATION_LOCK, 60))
+                locked = cursor.fetchone()['locked'] == 1
+                if not locked:
+                    logger.error("Another process is running migrations")
+                    return None
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INT PRIMARY KEY,
+                        description VARCHAR(255),
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cursor.execute("SELECT version FROM schema_migrations")
+                done = {row['version'] for row in cursor.fetchall()}
+                
+                applied = []
+                for version, description, step in MIGRATIONS:
+                    if version in done or (target is not None and version > target):
+                        continue
+                    logger.info(f"Applying migration {version}: {description}")
+                    step(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                        (version, description)
+                    )
+                    connection.commit()
+                    applied.append(version)
             
+            logger.info(f"Schema up to date ({len(applied)} migrations applied)")
+            return applied
         except Exception as e:
-            logging.error(f"Error creating tables: {e}")
+            logger.error(f"Migration failed: {e}")
             connection.rollback()
+            return None
         finally:
-            if connection:
-                connection.close()
+            if locked:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+            connection.close()
     
     def insert_esp32_data(self, data):
         """บันทึกข้อมูล ESP32 ลงฐานข้อมูล"""
@@ -102,32 +404,72 @@ class Database:
         if not connection:
             return None
         
+        record = esp32_record(data, datetime.now().replace(microsecond=0))
         try:
             with connection.cursor() as cursor:
-                sql = """
-                    INSERT INTO esp32_data (temperature, humidity, light, device_id, raw_data)
-                    VALUES (%s, %s, %s, %s, %s)
-                """
-                cursor.execute(sql, (
-                    data.get('temperature'),
-                    data.get('humidity'),
-                    data.get('light'),
-                    data.get('device_id', 'ESP32_DEFAULT'),
-                    json.dumps(data)
-                ))
+                cursor.execute(ESP32_INSERT_SQL + ESP32_INSERT_ROW, esp32_row_params(record))
                 connection.commit()
-                record_id = cursor.lastrowid
+                record['id'] = record_id = cursor.lastrowid
                 logger.info(f"ESP32 data inserted with ID: {record_id}")
-                return record_id
         except Exception as e:
             logger.error(f"Error inserting ESP32 data: {e}")
             connection.rollback()
             return None
         finally:
             connection.close()
+        
+        self._notify_ingest([record])
+        return record_id
+    
+    def insert_esp32_data_batch(self, readings, received_at=None):
+        """บันทึกข้อมูล ESP32 หลายรายการด้วย multi-row INSERT ใน transaction เดียว
+        
+        คืนค่า list ของ record ID ตามลำดับของ readings หรือ None ถ้าบันทึกไม่สำเร็จ
+        (ทั้ง batch จะถูก rollback) แต่ละ statement เป็น "simple insert" ที่รู้จำนวนแถว
+        ล่วงหน้า InnoDB จึงจอง AUTO_INCREMENT ให้เป็นช่วงต่อเนื่องเริ่มจาก lastrowid
+        received_at (ถ้ามี) คือเวลาที่ได้รับแต่ละรายการ ใช้เป็น timestamp แทนเวลาปัจจุบัน
+        """
+        if not readings:
+            return []
+        
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        now = datetime.now().replace(microsecond=0)
+        records = [
+            esp32_record(data, received_at[index] if received_at else now)
+            for index, data in enumerate(readings)
+        ]
+        chunk_size = self.config.ESP32_INSERT_CHUNK_SIZE
+        try:
+            with connection.cursor() as cursor:
+                for start in range(0, len(records), chunk_size):
+                    chunk = records[start:start + chunk_size]
+                    sql = ESP32_INSERT_SQL + ", ".join([ESP32_INSERT_ROW] * len(chunk))
+                    params = [value for record in chunk for value in esp32_row_params(record)]
+                    cursor.execute(sql, params)
+                    for offset, record in enumerate(chunk):
+                        record['id'] = cursor.lastrowid + offset
+                connection.commit()
+            logger.info(f"ESP32 batch inserted: {len(records)} rows, "
+                        f"IDs {records[0]['id']}-{records[-1]['id']}")
+        except Exception as e:
+            logger.error(f"Error inserting ESP32 data batch: {e}")
+            connection.rollback()
+            return None
+        finally:
+            connection.close()
+        
+        self._notify_ingest(records)
+        return [record['id'] for record in records]
     
     def get_esp32_data(self, limit=10, sensor_id=None):
-        """Get ESP32 data with optional filtering"""
+        """Get ESP32 data with optional filtering
+        
+        sensor_id is matched against the indexed device_id column, which holds
+        the normalized sensor_id/device_id sent by the device.
+        """
         try:
             connection = self.get_connection()
             cursor = connection.cursor()
@@ -136,7 +478,7 @@ class Database:
                 query = """
                     SELECT id, device_id, temperature, humidity, light, raw_data, timestamp 
                     FROM esp32_data 
-                    WHERE JSON_EXTRACT(raw_data, '$.sensor_id') = %s
+                    WHERE device_id = %s
                     ORDER BY timestamp DESC LIMIT %s
                 """
                 cursor.execute(query, (sensor_id, limit))
@@ -148,22 +490,7 @@ class Database:
                 """
                 cursor.execute(query, (limit,))
             
-            rows = cursor.fetchall()
-            
-            result = []
-            for row in rows:
-                data = {
-                    'id': row[0],
-                    'device_id': row[1],
-                    'temperature': row[2],
-                    'humidity': row[3],
-                    'light': row[4],
-                    'raw_data': json.loads(row[5]) if row[5] else {},
-                    'timestamp': row[6]
-                }
-                result.append(data)
-            
-            return result
+            return [format_esp32_row(row) for row in cursor.fetchall()]
             
         except Exception as e:
             logging.error(f"Error retrieving ESP32 data: {e}")
@@ -171,54 +498,533 @@ class Database:
         finally:
             if connection:
                 connection.close()
-
-    def create_device_tables(self):
-        """Create device management tables"""
+    
+    def get_esp32_data_page(self, limit=50, device_id=None, before=None, after=None,
+                            start=None, end=None, include_raw=True):
+        """Keyset page of ESP32 data ordered by (timestamp, id), newest first
+        
+        `before` / `after` are (timestamp, id) positions: rows strictly older
+        than `before` or strictly newer than `after` are returned, so every page
+        is an index range scan no matter how deep it is. `start` is inclusive
+        and `end` exclusive. Returns (rows, has_more) where has_more tells whether
+        more rows exist beyond the page in the direction of travel.
+        include_raw=False skips reading and decoding the raw_data JSON column.
+        """
+        conditions, params = esp32_filters(device_id, start, end)
+        # the plain timestamp bound lets MySQL prune partitions before the OR is applied
+        if before:
+            conditions.append("timestamp <= %s AND (timestamp < %s OR (timestamp = %s AND id < %s))")
+            params.extend([before[0], before[0], before[0], before[1]])
+        if after:
+            conditions.append("timestamp >= %s AND (timestamp > %s OR (timestamp = %s AND id > %s))")
+            params.extend([after[0], after[0], after[0], after[1]])
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "ASC" if after else "DESC"
+        columns = "id, device_id, temperature, humidity, light, raw_data, timestamp" if include_raw \
+            else "id, device_id, temperature, humidity, light, timestamp"
+        query = f"""
+            SELECT {columns}
+            FROM esp32_data
+            {where}
+            ORDER BY timestamp {order}, id {order}
+            LIMIT %s
+        """
+        params.append(limit + 1)
+        
+        connection = self.get_connection()
+        if not connection:
+            return None, False
+        
         try:
-            connection = self.get_connection()
-            cursor = connection.cursor()
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
             
-            # Create esp32_devices table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS esp32_devices (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    device_name VARCHAR(100) NOT NULL UNIQUE,
-                    device_type ENUM('ESP32', 'PICO_WH', 'ESP8266') DEFAULT 'ESP32',
-                    description TEXT,
-                    wifi_ssid VARCHAR(100),
-                    wifi_password VARCHAR(100),
-                    pin_config JSON,
-                    sensor_config JSON,
-                    program_template VARCHAR(50) DEFAULT 'basic_sensor',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE
+            has_more = len(rows) > limit
+            rows = [format_esp32_row(row) for row in rows[:limit]] if include_raw else rows[:limit]
+            if after:
+                rows.reverse()
+            return rows, has_more
+        except Exception as e:
+            logger.error(f"Error retrieving ESP32 data page: {e}")
+            return None, False
+        finally:
+            connection.close()
+    
+    def _get_esp32_series_from_rollup(self, suffix, start, end, bucket_seconds, device_id=None):
+        """Series from esp32_rollup_<suffix>, topped up with raw rows the rollup does not cover
+        
+        Only rollup buckets that lie wholly inside [start, end) are used; the
+        partial interval at either end comes from raw rows, so the result is
+        the same as the raw GROUP BY in get_esp32_series() for any start / end.
+        """
+        rollup_seconds = dict(ROLLUP_LEVELS)[suffix]
+        device_params = [device_id] if device_id else []
+        
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                # ขอบของช่วงที่ตรงกับ bucket ของ rollup (คำนวณใน MySQL ให้ใช้ time zone เดียวกับ UNIX_TIMESTAMP)
+                cursor.execute("""
+                    SELECT CEIL(UNIX_TIMESTAMP(%s) / %s) * %s AS lo,
+                           FLOOR(UNIX_TIMESTAMP(%s) / %s) * %s AS hi
+                """, (start, rollup_seconds, rollup_seconds, end, rollup_seconds, rollup_seconds))
+                bounds = cursor.fetchone()
+                lo = int(bounds['lo'])
+                hi = max(int(bounds['hi']), lo)
+                params = ([bucket_seconds, bucket_seconds] +
+                          device_params + [lo, hi] +
+                          device_params + [lo, hi] +
+                          device_params + [start, end, lo] +
+                          device_params + [start, end, hi])
+                cursor.execute(_rollup_series_sql(suffix, bool(device_id)), params)
+                return cursor.fetchall()
+        except Exception as e:
+            logger.warning(f"Rollup series unavailable, falling back to raw data: {e}")
+            return None
+        finally:
+            connection.close()
+    
+    def refresh_rollups(self, max_rows=None):
+        """Fold esp32_data rows past the watermark into every rollup table
+        
+        Each run only processes IDs that were already visible in the previous
+        run (seen_max_id), giving in-flight inserts one interval to commit
+        before their ID range is consumed. The state row is locked FOR UPDATE,
+        so concurrent workers take turns instead of double counting.
+        Returns {'from_id', 'to_id', 'caught_up'} or None on error.
+        """
+        max_rows = max_rows or self.config.ROLLUP_BATCH_ROWS
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT last_id, seen_max_id FROM esp32_rollup_state WHERE name = %s FOR UPDATE",
+                    (ROLLUP_STATE_NAME,)
                 )
-            """)
-            
-            # Create program_templates table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS program_templates (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    template_name VARCHAR(100) NOT NULL UNIQUE,
-                    template_type ENUM('ESP32', 'PICO_WH', 'ESP8266') DEFAULT 'ESP32',
-                    description TEXT,
-                    code_template LONGTEXT,
-                    required_libraries JSON,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                state = cursor.fetchone()
+                if not state:
+                    raise RuntimeError("Rollup state missing, run `flask migrate` first")
+                
+                last_id = state['last_id']
+                upper = min(state['seen_max_id'], last_id + max_rows)
+                if upper > last_id:
+                    for suffix, seconds in ROLLUP_LEVELS:
+                        cursor.execute(_rollup_upsert_sql(suffix), (seconds, seconds, last_id, upper))
+                
+                caught_up = upper >= state['seen_max_id']
+                seen_max_id = state['seen_max_id']
+                if caught_up:
+                    cursor.execute("SELECT MAX(id) AS max_id FROM esp32_data")
+                    seen_max_id = cursor.fetchone()['max_id'] or 0
+                cursor.execute(
+                    "UPDATE esp32_rollup_state SET last_id = %s, seen_max_id = %s WHERE name = %s",
+                    (max(upper, last_id), seen_max_id, ROLLUP_STATE_NAME)
                 )
-            """)
-            
             connection.commit()
-            logging.info("Device management tables created successfully")
-            
+            if upper > last_id:
+                logger.info(f"Rollups refreshed for IDs {last_id + 1}-{upper}")
+            return {'from_id': last_id, 'to_id': max(upper, last_id), 'caught_up': caught_up}
         except Exception as e:
-            logging.error(f"Error creating device tables: {e}")
+            logger.error(f"Error refreshing rollups: {e}")
             connection.rollback()
+            return None
         finally:
-            if connection:
+            connection.close()
+    
+    def _esp32_partitions(self, cursor):
+        """รายชื่อ partition ของ esp32_data ตามลำดับ (list ว่างถ้ายังไม่ได้แบ่ง partition)"""
+        cursor.execute("""
+            SELECT PARTITION_NAME AS name FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'esp32_data'
+              AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """)
+        return [row['name'] for row in cursor.fetchall()]
+    
+    def partition_esp32_data(self):
+        """Convert esp32_data to RANGE partitioning on timestamp (one-time migration)
+        
+        The primary key becomes (id, timestamp) because MySQL requires the
+        partitioning column in every unique key. ALTER TABLE rebuilds the whole
+        table, so run it in a maintenance window on large installations.
+        """
+        granularity = self.config.ESP32_PARTITION_GRANULARITY
+        connection = self.get_connection()
+        if not connection:
+            return False
+        
+        try:
+            with connection.cursor() as cursor:
+                if self._esp32_partitions(cursor):
+                    logger.info("esp32_data is already partitioned")
+                    return True
+                
+                cursor.execute("SELECT MIN(timestamp) AS first_timestamp FROM esp32_data")
+                first = cursor.fetchone()['first_timestamp']
+                day = first.date() if first else date.today()
+                last_day = date.today() + timedelta(days=self._partition_ahead_days())
+                definitions = []
+                while day <= last_day:
+                    name, _, upper = partition_period(day, granularity)
+                    definitions.append(partition_definition(name, upper))
+                    day = upper
+                definitions.append(f"PARTITION {PARTITION_FUTURE} VALUES LESS THAN MAXVALUE")
+                
+                logger.info(f"Partitioning esp32_data into {len(definitions)} partitions")
+                cursor.execute("ALTER TABLE esp32_data DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)")
+                cursor.execute(f"""
+                    ALTER TABLE esp32_data
+                    PARTITION BY RANGE (UNIX_TIMESTAMP(timestamp)) (
+                        {', '.join(definitions)}
+                    )
+                """)
+            return True
+        except Exception as e:
+            logger.error(f"Error partitioning esp32_data: {e}")
+            return False
+        finally:
+            connection.close()
+    
+    def _partition_ahead_days(self):
+        ahead = self.config.ESP32_PARTITIONS_AHEAD
+        return ahead * 31 if self.config.ESP32_PARTITION_GRANULARITY == 'month' else ahead
+    
+    def maintain_esp32_partitions(self):
+        """Pre-create future partitions and drop those past the retention period
+        
+        New periods are split off the empty p_future partition and expired
+        ones are removed with DROP PARTITION, which is instant compared to a
+        DELETE. A MySQL named lock keeps workers from running it concurrently.
+        Returns {'created': [...], 'dropped': [...]} or None when skipped/failed.
+        """
+        granularity = self.config.ESP32_PARTITION_GRANULARITY
+        retention_days = self.config.ESP32_RETENTION_DAYS
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 0) AS locked", (PARTITION_LOCK,))
+                if not cursor.fetchone()['locked']:
+                    return None
+                try:
+                    partitions = self._esp32_partitions(cursor)
+                    if not partitions:
+                        logger.debug("esp32_data is not partitioned, skipping maintenance")
+                        return None
+                    
+                    dated = [name for name in partitions if name != PARTITION_FUTURE]
+                    created = []
+                    day = partition_upper_bound(dated[-1]) if dated else date.today()
+                    last_day = date.today() + timedelta(days=self._partition_ahead_days())
+                    while day <= last_day:
+                        name, _, upper = partition_period(day, granularity)
+                        cursor.execute(f"""
+                            ALTER TABLE esp32_data REORGANIZE PARTITION {PARTITION_FUTURE} INTO (
+                                {partition_definition(name, upper)},
+                                PARTITION {PARTITION_FUTURE} VALUES LESS THAN MAXVALUE
+                            )
+                        """)
+                        created.append(name)
+                        day = upper
+                    
+                    dropped = []
+                    if retention_days > 0:
+                        cutoff = date.today() - timedelta(days=retention_days)
+                        dropped = [name for name in dated if partition_upper_bound(name) <= cutoff]
+                        if dropped:
+                            cursor.execute(f"ALTER TABLE esp32_data DROP PARTITION {', '.join(dropped)}")
+                            # MAX(id) ไม่เปลี่ยนเมื่อลบข้อมูลเก่า: เพิ่ม version ให้ ETag ของ esp32_data เปลี่ยน
+                            self._bump_table_version(cursor, 'esp32_data')
+                            connection.commit()
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (PARTITION_LOCK,))
+            
+            if created or dropped:
+                logger.info(f"esp32_data partitions created: {created}, dropped: {dropped}")
+            return {'created': created, 'dropped': dropped}
+        except Exception as e:
+            logger.error(f"Error maintaining esp32_data partitions: {e}")
+            return None
+        finally:
+            connection.close()
+    
+    def iter_esp32_data(self, device_id=None, start=None, end=None, batch_size=1000):
+        """Stream ESP32 data oldest first in batches of formatted rows
+        
+        Uses an unbuffered server-side cursor (SSDictCursor) on a dedicated
+        connection, so memory stays at one batch however many rows match.
+        Errors are raised to the caller, since a half-sent stream cannot be
+        turned into an error response.
+        """
+        connection = self.get_connection(exclusive=True)
+        if not connection:
+            raise RuntimeError("Database connection unavailable")
+        
+        conditions, params = esp32_filters(device_id, start, end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        finished = False
+        previous_timeout = None
+        try:
+            with connection.cursor() as cursor:
+                # ผู้รับปลายทางอาจอ่านช้า ให้ server รอส่งข้อมูลได้นานขึ้น
+                cursor.execute("SELECT @@SESSION.net_write_timeout AS net_write_timeout")
+                previous_timeout = cursor.fetchone()['net_write_timeout']
+                cursor.execute("SET SESSION net_write_timeout = %s",
+                               (self.config.EXPORT_NET_WRITE_TIMEOUT,))
+            
+            cursor = connection.cursor(pymysql.cursors.SSDictCursor)
+            cursor.execute(f"""
+                SELECT id, device_id, temperature, humidity, light, raw_data, timestamp
+                FROM esp32_data
+                {where}
+                ORDER BY timestamp ASC, id ASC
+            """, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [format_esp32_row(row) for row in rows]
+            cursor.close()
+            finished = True
+        finally:
+            if finished and previous_timeout is not None:
+                # connection กลับเข้า pool: คืนค่า timeout เดิมให้ request ถัดไป
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute("SET SESSION net_write_timeout = %s", (previous_timeout,))
+                except Exception as e:
+                    logger.warning(f"Could not restore net_write_timeout after export: {e}")
+                    finished = False
+            if finished:
                 connection.close()
+            else:
+                # ยังมีผลลัพธ์ค้างใน socket หรือ session ยังใช้ timeout ของ export: ปิดทิ้งแทนการคืนเข้า pool
+                connection.discard()
+    
+    def get_esp32_series(self, start, end, bucket_seconds, device_id=None):
+        """Aggregate ESP32 data into fixed time buckets (min/max/avg/count)
+        
+        Buckets are aligned to the Unix epoch and computed by MySQL with
+        GROUP BY, so only one row per bucket leaves the database. When the
+        bucket is a multiple of a rollup granularity the coarsest such rollup
+        table is read instead of raw rows. Returns a list of dicts ordered by
+        bucket, or None on error.
+        """
+        if self.config.ROLLUP_ENABLED:
+            for suffix, seconds in ROLLUP_LEVELS:
+                if bucket_seconds % seconds == 0:
+                    rows = self._get_esp32_series_from_rollup(suffix, start, end, bucket_seconds, device_id)
+                    if rows is not None:
+                        return rows
+                    break
+        
+        conditions, params = esp32_filters(device_id, start, end)
+        query = f"""
+            SELECT UNIX_TIMESTAMP(timestamp) DIV %s * %s AS bucket,
+                   COUNT(*) AS count,
+                   MIN(temperature) AS temperature_min,
+                   MAX(temperature) AS temperature_max,
+                   AVG(temperature) AS temperature_avg,
+                   MIN(humidity) AS humidity_min,
+                   MAX(humidity) AS humidity_max,
+                   AVG(humidity) AS humidity_avg,
+                   MIN(light) AS light_min,
+                   MAX(light) AS light_max,
+                   AVG(light) AS light_avg
+            FROM esp32_data
+            WHERE {' AND '.join(conditions)}
+            GROUP BY bucket
+            ORDER BY bucket
+        """
+        
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(query, [bucket_seconds, bucket_seconds] + params)
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error retrieving ESP32 series: {e}")
+            return None
+        finally:
+            connection.close()
+    
+    def get_latest_esp32_per_device(self):
+        """ข้อมูลล่าสุดของแต่ละอุปกรณ์ (ใช้ loose index scan บน idx_device_timestamp)
+        
+        แถวใน batch เดียวกันมี timestamp เดียวกัน จึงเลือก id สูงสุดในกลุ่มที่ timestamp เท่ากัน
+        ให้ได้แถวเดียวต่ออุปกรณ์ ตามลำดับ (timestamp, id) เดียวกับ LatestReadingCache
+        """
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT e.id, e.device_id, e.temperature, e.humidity, e.light, e.raw_data, e.timestamp
+                    FROM esp32_data e
+                    JOIN (
+                        SELECT t.device_id, MAX(t.id) AS id
+                        FROM esp32_data t
+                        JOIN (
+                            SELECT device_id, MAX(timestamp) AS latest
+                            FROM esp32_data
+                            GROUP BY device_id
+                        ) l ON t.device_id = l.device_id AND t.timestamp = l.latest
+                        GROUP BY t.device_id
+                    ) m ON e.id = m.id
+                """)
+                return [format_esp32_row(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error retrieving latest ESP32 data per device: {e}")
+            return None
+        finally:
+            connection.close()
+    
+    def get_esp32_data_after_id(self, last_id, limit=1000):
+        """ข้อมูลที่มี id มากกว่า last_id เรียงตาม id (primary key range scan)"""
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id, device_id, temperature, humidity, light, raw_data, timestamp
+                    FROM esp32_data
+                    WHERE id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (last_id, limit))
+                return [format_esp32_row(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error retrieving new ESP32 data: {e}")
+            return None
+        finally:
+            connection.close()
+    
+    def migrate_device_identity(self, batch_size=10000):
+        """Backfill esp32_data.device_id from raw_data.sensor_id and ensure its index
+        
+        Rows written by the generated firmware only carry `sensor_id` inside
+        raw_data, so their device_id column holds the default value. The update
+        walks the primary key in ranges and commits per range to keep locks short.
+        Returns the number of rows updated, or None on error.
+        """
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT COUNT(*) AS count FROM information_schema.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'esp32_data'
+                      AND INDEX_NAME = 'idx_device_timestamp'
+                """)
+                if not cursor.fetchone()['count']:
+                    logger.info("Adding index idx_device_timestamp to esp32_data")
+                    cursor.execute(
+                        "ALTER TABLE esp32_data ADD INDEX idx_device_timestamp (device_id, timestamp)"
+                    )
+                
+                cursor.execute("SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM esp32_data")
+                bounds = cursor.fetchone()
+                if bounds['min_id'] is None:
+                    return 0
+                
+                updated = 0
+                for start in range(bounds['min_id'] - 1, bounds['max_id'], batch_size):
+                    cursor.execute("""
+                        UPDATE esp32_data
+                        SET device_id = LEFT(TRIM(JSON_UNQUOTE(JSON_EXTRACT(raw_data, '$.sensor_id'))), %s)
+                        WHERE id > %s AND id <= %s
+                          AND (device_id IS NULL OR device_id = %s)
+                          AND JSON_TYPE(JSON_EXTRACT(raw_data, '$.sensor_id')) NOT IN ('NULL', 'OBJECT', 'ARRAY')
+                          AND TRIM(JSON_UNQUOTE(JSON_EXTRACT(raw_data, '$.sensor_id'))) <> ''
+                    """, (DEVICE_ID_MAX_LENGTH, start, start + batch_size, DEFAULT_DEVICE_ID))
+                    updated += cursor.rowcount
+                    connection.commit()
+                
+                logger.info(f"Device identity backfill complete: {updated} rows updated")
+                return updated
+        except Exception as e:
+            logger.error(f"Error migrating device identity: {e}")
+            connection.rollback()
+            return None
+        finally:
+            connection.close()
+
+    def _bump_table_version(self, cursor, table_name):
+        """เพิ่ม version ของตาราง (เรียกใน transaction เดียวกับการเขียน ก่อน commit)"""
+        cursor.execute("""
+            INSERT INTO table_versions (table_name, version) VALUES (%s, 1)
+            ON DUPLICATE KEY UPDATE version = version + 1
+        """, (table_name,))
+    
+    def get_table_version(self, table_name):
+        """Return (version, updated_at) of a table, (0, None) if never written, None on error"""
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT version, updated_at FROM table_versions WHERE table_name = %s",
+                    (table_name,)
+                )
+                row = cursor.fetchone()
+                return (row['version'], row['updated_at']) if row else (0, None)
+        except Exception as e:
+            logger.error(f"Error fetching version of {table_name}: {e}")
+            return None
+        finally:
+            connection.close()
+    
+    def get_esp32_data_version(self, device_id=None):
+        """Return (newest id, delete counter, newest timestamp) of esp32_data, None on error
+        
+        The id moves on every insert; the table_versions counter moves on
+        deletes (partition retention), which leave MAX(id) alone. The id is of the whole table even when `device_id` is
+        given: MAX(id) is read from the primary key and MAX(timestamp) from
+        idx_timestamp / idx_device_timestamp, so both are single index
+        lookups. Every worker sees the same value, unlike the per-process
+        latest reading cache.
+        """
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        conditions, params = esp32_filters(device_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT (SELECT MAX(id) FROM esp32_data) AS max_id,
+                           (SELECT version FROM table_versions WHERE table_name = 'esp32_data') AS deletes,
+                           (SELECT MAX(timestamp) FROM esp32_data {where}) AS last_modified
+                """, params)
+                row = cursor.fetchone()
+                return row['max_id'] or 0, row['deletes'] or 0, row['last_modified']
+        except Exception as e:
+            logger.error(f"Error fetching esp32_data version: {e}")
+            return None
+        finally:
+            connection.close()
 
     def add_device(self, device_data):
         """Add a new ESP32/PICO device"""
@@ -245,7 +1051,9 @@ class Database:
             ))
             
             device_id = cursor.lastrowid
+            self._bump_table_version(cursor, 'esp32_devices')
             connection.commit()
+            self._notify_device_change()
             logging.info(f"Device added successfully with ID: {device_id}")
             return device_id
             
@@ -282,25 +1090,7 @@ class Database:
                 """
                 cursor.execute(query)
             
-            rows = cursor.fetchall()
-            devices = []
-            
-            for row in rows:
-                device = {
-                    'id': row[0],
-                    'device_name': row[1],
-                    'device_type': row[2],
-                    'description': row[3],
-                    'wifi_ssid': row[4],
-                    'pin_config': json.loads(row[5]) if row[5] else {},
-                    'sensor_config': json.loads(row[6]) if row[6] else {},
-                    'program_template': row[7],
-                    'created_at': row[8],
-                    'is_active': row[9]
-                }
-                devices.append(device)
-            
-            return devices
+            return [decode_device_row(row) for row in cursor.fetchall()]
             
         except Exception as e:
             logging.error(f"Error retrieving devices: {e}")
@@ -323,22 +1113,7 @@ class Database:
             """
             cursor.execute(query, (device_id,))
             row = cursor.fetchone()
-            
-            if row:
-                return {
-                    'id': row[0],
-                    'device_name': row[1],
-                    'device_type': row[2],
-                    'description': row[3],
-                    'wifi_ssid': row[4],
-                    'wifi_password': row[5],
-                    'pin_config': json.loads(row[6]) if row[6] else {},
-                    'sensor_config': json.loads(row[7]) if row[7] else {},
-                    'program_template': row[8],
-                    'created_at': row[9],
-                    'is_active': row[10]
-                }
-            return None
+            return decode_device_row(row) if row else None
             
         except Exception as e:
             logging.error(f"Error retrieving device: {e}")
@@ -349,84 +1124,130 @@ class Database:
 
     def add_program_template(self, template_data):
         """Add a program template"""
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
         try:
-            connection = self.get_connection()
-            cursor = connection.cursor()
-            
-            query = """
-                INSERT INTO program_templates 
-                (template_name, template_type, description, code_template, required_libraries)
-                VALUES (%s, %s, %s, %s, %s)
-            """
-            
-            cursor.execute(query, (
-                template_data['template_name'],
-                template_data['template_type'],
-                template_data['description'],
-                template_data['code_template'],
-                json.dumps(template_data['required_libraries'])
-            ))
-            
-            template_id = cursor.lastrowid
-            connection.commit()
-            logging.info(f"Program template added successfully with ID: {template_id}")
-            return template_id
+            with connection.cursor() as cursor:
+                query = """
+                    INSERT INTO program_templates 
+                    (template_name, template_type, description, code_template, required_libraries)
+                    VALUES (%s, %s, %s, %s, %s)
+                """
+                
+                cursor.execute(query, (
+                    template_data['template_name'],
+                    template_data['template_type'],
+                    template_data['description'],
+                    template_data['code_template'],
+                    json.dumps(template_data['required_libraries'])
+                ))
+                
+                template_id = cursor.lastrowid
+                self._bump_table_version(cursor, 'program_templates')
+                connection.commit()
+                self._notify_template_change()
+                logger.info(f"Program template added successfully with ID: {template_id}")
+                return template_id
             
         except Exception as e:
-            logging.error(f"Error adding program template: {e}")
+            logger.error(f"Error adding program template: {e}")
             connection.rollback()
             return None
         finally:
-            if connection:
-                connection.close()
-
+            connection.close()
+    
+    def update_program_template(self, template_id, template_data):
+        """แก้ไข program template (เฉพาะ field ที่ส่งมา)"""
+        fields = [field for field in ('template_name', 'template_type', 'description',
+                                      'code_template', 'required_libraries')
+                  if field in template_data]
+        if not fields:
+            return False
+        
+        connection = self.get_connection()
+        if not connection:
+            return False
+        
+        try:
+            with connection.cursor() as cursor:
+                values = [json.dumps(template_data[field]) if field == 'required_libraries'
+                          else template_data[field] for field in fields]
+                assignments = ', '.join(f"{field} = %s" for field in fields)
+                cursor.execute(f"UPDATE program_templates SET {assignments} WHERE id = %s",
+                               (*values, template_id))
+                updated = cursor.rowcount > 0
+                if updated:
+                    self._bump_table_version(cursor, 'program_templates')
+                connection.commit()
+                if updated:
+                    self._notify_template_change()
+                    logger.info(f"Program template {template_id} updated")
+                return updated
+        except Exception as e:
+            logger.error(f"Error updating program template: {e}")
+            connection.rollback()
+            return False
+        finally:
+            connection.close()
+    
     def get_program_templates(self, template_type=None):
         """Get program templates"""
+        connection = self.get_connection()
+        if not connection:
+            return []
+        
         try:
-            connection = self.get_connection()
-            cursor = connection.cursor()
-            
-            if template_type:
-                query = """
-                    SELECT id, template_name, template_type, description, 
-                           code_template, required_libraries, created_at
-                    FROM program_templates 
-                    WHERE template_type = %s
-                    ORDER BY template_name
-                """
-                cursor.execute(query, (template_type,))
-            else:
+            with connection.cursor() as cursor:
                 query = """
                     SELECT id, template_name, template_type, description, 
                            code_template, required_libraries, created_at
                     FROM program_templates 
-                    ORDER BY template_name
                 """
-                cursor.execute(query)
-            
-            rows = cursor.fetchall()
-            templates = []
-            
-            for row in rows:
-                template = {
-                    'id': row[0],
-                    'template_name': row[1],
-                    'template_type': row[2],
-                    'description': row[3],
-                    'code_template': row[4],
-                    'required_libraries': json.loads(row[5]) if row[5] else [],
-                    'created_at': row[6]
-                }
-                templates.append(template)
-            
-            return templates
+                if template_type:
+                    cursor.execute(query + " WHERE template_type = %s ORDER BY template_name", (template_type,))
+                else:
+                    cursor.execute(query + " ORDER BY template_name")
+                
+                templates = cursor.fetchall()
+                for template in templates:
+                    template['required_libraries'] = json.loads(template['required_libraries']) \
+                        if template['required_libraries'] else []
+                return templates
             
         except Exception as e:
-            logging.error(f"Error retrieving program templates: {e}")
+            logger.error(f"Error retrieving program templates: {e}")
             return []
         finally:
-            if connection:
-                connection.close()
+            connection.close()
+    
+    def load_program_templates(self):
+        """อ่าน version และ template ที่มี code_template สำหรับ TemplateLibrary
+        
+        Returns (version, rows) or None on error.
+        """
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                # version ก่อนข้อมูล เหมือน load_device_registry()
+                cursor.execute("SELECT version FROM table_versions WHERE table_name = 'program_templates'")
+                row = cursor.fetchone()
+                version = row['version'] if row else 0
+                cursor.execute("""
+                    SELECT id, template_name, template_type, code_template
+                    FROM program_templates
+                    WHERE code_template IS NOT NULL AND code_template != ''
+                """)
+                return version, cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error loading program templates: {e}")
+            return None
+        finally:
+            connection.close()
     
     def get_latest_esp32_data(self):
         """ดึงข้อมูล ESP32 ล่าสุด"""
@@ -508,7 +1329,62 @@ class Database:
         finally:
             connection.close()
     
+    def get_approximate_database_stats(self):
+        """สถิติฐานข้อมูลแบบประมาณจาก information_schema (ไม่ต้องสแกนตาราง)
+        
+        TABLE_ROWS ของ InnoDB เป็นค่าประมาณจากสถิติของ index อาจคลาดเคลื่อนได้มาก
+        """
+        connection = self.get_connection()
+        if not connection:
+            return {}
+        
+        try:
+            stats = {}
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    SELECT TABLE_NAME AS name, TABLE_ROWS AS row_count
+                    FROM information_schema.TABLES
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ('esp32_data', 'user_data')
+                """)
+                counts = {row['name']: row['row_count'] or 0 for row in cursor.fetchall()}
+                stats['esp32_count'] = counts.get('esp32_data', 0)
+                stats['user_data_count'] = counts.get('user_data', 0)
+                
+                cursor.execute("SELECT timestamp FROM esp32_data ORDER BY timestamp DESC LIMIT 1")
+                result = cursor.fetchone()
+                stats['last_esp32_data'] = result['timestamp'] if result else None
+            
+            return stats
+        except Exception as e:
+            logger.error(f"Error fetching approximate database stats: {e}")
+            return {}
+        finally:
+            connection.close()
+    
     # ESP32 Device Management Methods
+    def load_device_registry(self):
+        """อ่าน version และทุกแถวของ esp32_devices (รวมที่ถูกลบแบบ soft delete) สำหรับ DeviceRegistry
+        
+        Returns (version, rows) with JSON columns decoded, or None on error.
+        """
+        connection = self.get_connection()
+        if not connection:
+            return None
+        
+        try:
+            with connection.cursor() as cursor:
+                # version ก่อนข้อมูล: ถ้ามีการแก้ไขระหว่างนี้ version จะต่างและโหลดใหม่รอบถัดไป
+                cursor.execute("SELECT version FROM table_versions WHERE table_name = 'esp32_devices'")
+                row = cursor.fetchone()
+                version = row['version'] if row else 0
+                cursor.execute("SELECT * FROM esp32_devices")
+                return version, [decode_device_row(device) for device in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error loading device registry: {e}")
+            return None
+        finally:
+            connection.close()
+    
     def get_esp32_devices(self, active_only=True):
         """ดึงรายการ ESP32 devices"""
         connection = self.get_connection()
@@ -523,17 +1399,7 @@ class Database:
                     sql = "SELECT * FROM esp32_devices ORDER BY device_name"
                 
                 cursor.execute(sql)
-                devices = cursor.fetchall()
-                
-                # แปลง pin_config จาก JSON
-                for device in devices:
-                    if device['pin_config']:
-                        try:
-                            device['pin_config'] = json.loads(device['pin_config'])
-                        except (json.JSONDecodeError, TypeError):
-                            device['pin_config'] = {}
-                
-                return devices
+                return [decode_device_row(device) for device in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Error fetching ESP32 devices: {e}")
             return []
@@ -551,14 +1417,7 @@ class Database:
                 sql = "SELECT * FROM esp32_devices WHERE device_id = %s"
                 cursor.execute(sql, (device_id,))
                 device = cursor.fetchone()
-                
-                if device and device['pin_config']:
-                    try:
-                        device['pin_config'] = json.loads(device['pin_config'])
-                    except (json.JSONDecodeError, TypeError):
-                        device['pin_config'] = {}
-                
-                return device
+                return decode_device_row(device) if device else None
         except Exception as e:
             logger.error(f"Error fetching ESP32 device: {e}")
             return None
@@ -586,8 +1445,10 @@ class Database:
                     device_data.get('location', ''),
                     device_data.get('program_code', '')
                 ))
-                connection.commit()
                 device_id = cursor.lastrowid
+                self._bump_table_version(cursor, 'esp32_devices')
+                connection.commit()
+                self._notify_device_change()
                 logger.info(f"ESP32 device added with ID: {device_id}")
                 return device_id
         except Exception as e:
@@ -619,8 +1480,11 @@ class Database:
                     device_data.get('program_code', ''),
                     device_id
                 ))
+                updated = cursor.rowcount > 0
+                self._bump_table_version(cursor, 'esp32_devices')
                 connection.commit()
-                return cursor.rowcount > 0
+                self._notify_device_change()
+                return updated
         except Exception as e:
             logger.error(f"Error updating ESP32 device: {e}")
             connection.rollback()
@@ -638,8 +1502,11 @@ class Database:
             with connection.cursor() as cursor:
                 sql = "UPDATE esp32_devices SET is_active = FALSE WHERE device_id = %s"
                 cursor.execute(sql, (device_id,))
+                deleted = cursor.rowcount > 0
+                self._bump_table_version(cursor, 'esp32_devices')
                 connection.commit()
-                return cursor.rowcount > 0
+                self._notify_device_change()
+                return deleted
         except Exception as e:
             logger.error(f"Error deleting ESP32 device: {e}")
             connection.rollback()
@@ -723,7 +1590,9 @@ class Database:
             with connection.cursor() as cursor:
                 sql = "UPDATE esp32_devices SET last_seen = NOW() WHERE device_id = %s"
                 cursor.execute(sql, (device_id,))
+                self._bump_table_version(cursor, 'esp32_devices')
                 connection.commit()
+                self._notify_device_change()
                 return True
         except Exception as e:
             logger.error(f"Error updating device last seen: {e}")
@@ -0,0 +1,261 @@
+"""
+Connection pool for PyMySQL
+Keeps warm MySQL connections so each request does not pay a TCP + auth handshake
+"""
+
+import os
+import threading
+import time
+import logging
+
+from pymysql.constants import SERVER_STATUS
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+class PooledConnection:
+    """Wrapper around a pymysql connection that returns itself to the pool on close()"""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.owner = None
+        self.depth = 0
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        """คืนการเชื่อมต่อกลับเข้า pool (ไม่ได้ปิด socket จริง)"""
+        self._pool.release(self)
+
+    def discard(self):
+        """ปิด socket ทันทีแล้วคืน slot ให้ pool (เช่นเมื่อยังอ่านผลของ unbuffered query ไม่หมด)"""
+        try:
+            self._raw._force_close()
+        except Exception:
+            pass
+        self._pool.release(self)
+
+
+class ConnectionPool:
+    """Bounded, thread-aware pool of MySQL connections
+
+    A thread that already holds a connection gets the same one back from
+    acquire() (checkouts are counted and the connection goes back to the pool
+    when the outermost close() runs), so nested Database calls never need a
+    second slot. Idle connections are pinged before reuse, evicted after
+    `idle_timeout` seconds and retired after `max_lifetime` seconds.
+    """
+
+    def __init__(self, connect, max_size=10, timeout=5.0, idle_timeout=300,
+                 max_lifetime=3600, ping_interval=30):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self._idle = []  # LIFO: the most recently used connection is on top
+        self._size = 0
+        self._in_use = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._checkouts = 0
+        self._created = 0
+        self._closed = 0
+        self._ping_failures = 0
+
+    def _check_fork(self):
+        """ทิ้ง connection ที่ได้รับมาจาก parent process หลัง fork
+
+        ห้ามเรียก close() กับ connection ของ parent เพราะจะส่ง COM_QUIT ผ่าน socket
+        ที่ใช้ร่วมกันและตัด session ของ parent ไปด้วย
+        """
+        if self._pid != os.getpid():
+            logger.info("Process forked, discarding inherited connection pool")
+            self._reset_state()
+
+    def reset(self):
+        """Drop every pooled connection without closing it (use right after fork)"""
+        self._reset_state()
+
+    def _expired(self, conn, now):
+        if self.max_lifetime and now - conn.created_at > self.max_lifetime:
+            return True
+        if self.idle_timeout and now - conn.last_used > self.idle_timeout:
+            return True
+        return False
+
+    def _evict_locked(self, now):
+        """Remove expired idle connections; caller closes them outside the lock"""
+        keep, evicted = [], []
+        for conn in self._idle:
+            (evicted if self._expired(conn, now) else keep).append(conn)
+        if evicted:
+            self._idle = keep
+            self._size -= len(evicted)
+            self._cond.notify(len(evicted))
+        return evicted
+
+    def _discard(self, conns):
+        for conn in conns:
+            try:
+                conn._raw.close()
+            except Exception:
+                pass
+            with self._cond:
+                self._closed += 1
+
+    def acquire(self, exclusive=False):
+        """Check out a connection for the current thread
+
+        With exclusive=True the caller always gets a connection of its own
+        instead of the one the thread may already hold (needed while an
+        unbuffered result set is being read).
+        """
+        self._check_fork()
+
+        conn = None if exclusive else getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.depth += 1
+            return conn
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            wait_started = None
+            evicted = []
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    evicted += self._evict_locked(now)
+                    if self._idle:
+                        conn = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn = None
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        if wait_started is not None:
+                            self._wait_time += now - wait_started
+                        raise PoolTimeout(
+                            f"No database connection available after {self.timeout}s "
+                            f"(pool size {self.max_size})"
+                        )
+                    if wait_started is None:
+                        wait_started = now
+                        self._waits += 1
+                    self._cond.wait(remaining)
+                if wait_started is not None:
+                    self._wait_time += time.monotonic() - wait_started
+            self._discard(evicted)
+
+            if conn is None:
+                try:
+                    conn = PooledConnection(self, self._connect())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+            elif self.ping_interval is not None and \
+                    time.monotonic() - conn.last_used >= self.ping_interval:
+                try:
+                    conn._raw.ping(reconnect=False)
+                except Exception as e:
+                    logger.warning(f"Dropping dead pooled connection: {e}")
+                    with self._cond:
+                        self._size -= 1
+                        self._ping_failures += 1
+                        self._cond.notify()
+                    self._discard([conn])
+                    continue
+
+            conn.depth = 1
+            conn.owner = threading.get_ident()
+            if not exclusive:
+                self._local.conn = conn
+            with self._cond:
+                self._in_use += 1
+                self._checkouts += 1
+            return conn
+
+    def release(self, conn):
+        """Return a connection checked out by the current thread"""
+        if conn.owner != threading.get_ident() or conn.depth <= 0:
+            logger.warning("Ignoring close() of a connection not held by this thread")
+            return
+        conn.depth -= 1
+        if conn.depth:
+            return
+
+        conn.owner = None
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.conn = None
+        raw = conn._raw
+        keep = raw.open
+        if keep and raw.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            # จบ transaction ที่ค้างอยู่ เพื่อให้ผู้ใช้คนถัดไปได้ snapshot ใหม่
+            try:
+                raw.rollback()
+            except Exception:
+                keep = False
+
+        now = time.monotonic()
+        if keep and self.max_lifetime and now - conn.created_at > self.max_lifetime:
+            keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep and self._pid == os.getpid():
+                conn.last_used = now
+                self._idle.append(conn)
+            else:
+                self._size -= 1
+            self._cond.notify()
+        if not keep:
+            self._discard([conn])
+
+    def close_all(self):
+        """Close every idle connection (in-use ones are closed when returned)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        self._discard(idle)
+
+    def stats(self):
+        """Snapshot of pool counters for sizing the pool under load"""
+        with self._cond:
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_ms': round(self._wait_time * 1000, 2),
+                'avg_wait_ms': round(self._wait_time * 1000 / self._waits, 2) if self._waits else 0.0,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'closed': self._closed,
+                'ping_failures': self._ping_failures,
+            }
@@ -0,0 +1,128 @@
+"""
+In-process device registry
+Caches esp32_devices (JSON columns already decoded) keyed by id, device_name and
+device_id. Writes through Database invalidate it immediately; writes made by
+other worker processes are noticed through the table_versions counter, which
+is checked at most every `check_interval` seconds.
+"""
+
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns returned by Database.get_devices() (no wifi_password)
+DEVICE_LIST_FIELDS = ('id', 'device_name', 'device_type', 'description', 'wifi_ssid',
+                      'pin_config', 'sensor_config', 'program_template', 'created_at', 'is_active')
+DEVICE_DETAIL_FIELDS = DEVICE_LIST_FIELDS[:5] + ('wifi_password',) + DEVICE_LIST_FIELDS[5:]
+
+
+def _project(row, fields):
+    return {field: row.get(field) for field in fields}
+
+
+class DeviceRegistry:
+    """Read-mostly cache of esp32_devices with the same read methods as Database
+
+    Returned dicts are copies, but pin_config / sensor_config are shared with
+    the cache and must be treated as read-only.
+    """
+
+    def __init__(self, db, check_interval=2):
+        self.db = db
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._rows = None
+        self._by_id = {}
+        self._by_name = {}
+        self._by_device_id = {}
+        self.version = None
+        self._checked_at = 0.0
+        self._generation = 0  # bumped by invalidate(); a load that raced with it stays stale
+        self._stale = True
+        self.hits = 0
+        self.loads = 0
+
+    def invalidate(self):
+        """Device listener: drop the cached rows (called after a local write commits)"""
+        with self._lock:
+            self._generation += 1
+            self._stale = True
+
+    def _snapshot(self):
+        """Current rows, reloading when invalidated or the table version moved"""
+        with self._lock:
+            if not self._stale and time.monotonic() - self._checked_at < self.check_interval:
+                self.hits += 1
+                return self._rows
+            generation = self._generation
+            stale = self._stale
+
+        if not stale:
+            current = self.db.get_table_version('esp32_devices')
+            if current is not None and current[0] == self.version:
+                with self._lock:
+                    self._checked_at = time.monotonic()
+                    self.hits += 1
+                return self._rows
+
+        loaded = self.db.load_device_registry()
+        if loaded is None:
+            # ฐานข้อมูลมีปัญหา ใช้ข้อมูลเดิมไปก่อนถ้ามี
+            return self._rows or []
+        version, rows = loaded
+
+        with self._lock:
+            self._rows = rows
+            self._by_id = {row['id']: row for row in rows}
+            self._by_name = {row['device_name']: row for row in rows}
+            self._by_device_id = {row['device_id']: row for row in rows if row.get('device_id')}
+            self.version = version
+            self._checked_at = time.monotonic()
+            self._stale = generation != self._generation
+            self.loads += 1
+        logger.info(f"Device registry loaded {len(rows)} devices (version {version})")
+        return rows
+
+    def current_version(self):
+        """Table version of the cached snapshot (refreshing it first if due)"""
+        self._snapshot()
+        return self.version
+
+    # Same results as the Database methods of the same name
+    def get_devices(self, device_type=None):
+        rows = [row for row in self._snapshot()
+                if row['is_active'] and (not device_type or row['device_type'] == device_type)]
+        rows.sort(key=lambda row: row['created_at'], reverse=True)
+        return [_project(row, DEVICE_LIST_FIELDS) for row in rows]
+
+    def get_device_by_id(self, device_id):
+        self._snapshot()
+        row = self._by_id.get(device_id)
+        return _project(row, DEVICE_DETAIL_FIELDS) if row and row['is_active'] else None
+
+    def get_device_by_name(self, device_name):
+        self._snapshot()
+        row = self._by_name.get(device_name)
+        return _project(row, DEVICE_DETAIL_FIELDS) if row and row['is_active'] else None
+
+    def get_esp32_devices(self, active_only=True):
+        rows = [dict(row) for row in self._snapshot() if row['is_active'] or not active_only]
+        rows.sort(key=lambda row: row['device_name'])
+        return rows
+
+    def get_esp32_device(self, device_id):
+        self._snapshot()
+        row = self._by_device_id.get(device_id)
+        return dict(row) if row else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'devices': len(self._rows or ()),
+                'version': self.version,
+                'stale': self._stale,
+                'hits': self.hits,
+                'loads': self.loads,
+            }
@@ -0,0 +1,192 @@
+"""
+Fleet firmware bundles
+Renders main.py and the uploader for many devices at once (in a process pool for
+large fleets) and writes them into a ZIP archive that is streamed while it is built
+"""
+
+import functools
+import io
+import json
+import multiprocessing
+import re
+import time
+import zipfile
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from code_generator import CodeGenerator
+from minifier import size_report
+from template_engine import TemplateLibrary
+
+logger = logging.getLogger(__name__)
+
+# Fixed timestamp so an unchanged device always gets byte-identical archive entries
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+REPORT_NAME = 'build_report.json'
+UNSAFE_PATH_CHARS = re.compile(r'[^\w.-]')
+
+
+def parse_id_list(value):
+    """'1,2, 5' -> {1, 2, 5}; empty -> None (no id filter)"""
+    if not value:
+        return None
+    try:
+        return {int(part) for part in value.split(',') if part.strip()}
+    except ValueError:
+        raise ValueError(f"Invalid device id list: {value}")
+
+
+def select_devices(devices, device_type=None, template=None, ids=None):
+    """Filter device rows by device type, program template and/or id set"""
+    return [device for device in devices
+            if (not device_type or device['device_type'] == device_type)
+            and (not template or device['program_template'] == template)
+            and (not ids or device['id'] in ids)]
+
+
+def archive_folder(device):
+    """โฟลเดอร์ของอุปกรณ์ใน ZIP: id + ชื่ออุปกรณ์ (แทนอักขระที่ใช้เป็น path ไม่ได้)"""
+    return f"{device['id']}_{UNSAFE_PATH_CHARS.sub('_', device['device_name'])}"
+
+
+# Generator of a pool worker process, built once by _init_worker()
+_worker_generator = None
+
+
+def _init_worker(template_rows):
+    global _worker_generator
+    _worker_generator = CodeGenerator(cache_size=16, templates=TemplateLibrary(rows=template_rows))
+
+
+def build_device(device, generator=None, minify=False, strip_prints=False):
+    """Render main.py and uploader.py for one device, timing each step"""
+    generator = generator or _worker_generator
+    template = device.get('program_template') or 'basic_sensor'
+    started = time.perf_counter()
+    main = generator.generate_code(device, template, minify, strip_prints)
+    rendered = time.perf_counter()
+    uploader = generator.generate_uploader(device, template, minify, strip_prints)
+    finished = time.perf_counter()
+    result = {
+        'id': device['id'],
+        'device_name': device['device_name'],
+        'device_type': device.get('device_type'),
+        'template': template,
+        'folder': archive_folder(device),
+        'files': {'main.py': main, 'uploader.py': uploader},
+        'main_ms': round((rendered - started) * 1000, 3),
+        'uploader_ms': round((finished - rendered) * 1000, 3),
+        'build_ms': round((finished - started) * 1000, 3),
+    }
+    if minify or strip_prints:
+        # ต้นฉบับอยู่ใน memo ของ generator แล้ว ไม่ต้อง render ใหม่
+        result['minified'] = size_report(generator.generate_code(device, template), main)
+    return result
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable sink for ZipFile; written bytes are handed out by drain()"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class FleetBundle:
+    """ZIP archive of generated code for a list of devices
+
+    chunks() renders the devices and yields archive bytes as each device is
+    added, so a download starts before the whole fleet is built. With
+    `workers` > 0 and at least `parallel_min` devices, rendering runs in a
+    spawn-based process pool whose workers get the program_templates rows
+    once; smaller fleets are rendered in this thread by `generator` (the
+    shared, memoized one). The archive ends with build_report.json, which is
+    also available as `report` once chunks() is exhausted.
+    """
+
+    def __init__(self, devices, generator, template_rows=(), workers=0, parallel_min=200,
+                 compresslevel=6, minify=False, strip_prints=False):
+        self.devices = devices
+        self.generator = generator
+        self.template_rows = list(template_rows)
+        self.workers = workers if len(devices) >= parallel_min else 0
+        self.compresslevel = compresslevel
+        self.build = functools.partial(build_device, minify=minify or strip_prints,
+                                       strip_prints=strip_prints)
+        self.report = None
+
+    def _results(self):
+        if not self.workers:
+            for device in self.devices:
+                yield self.build(device, self.generator)
+            return
+
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.template_rows,)
+        )
+        try:
+            # map() คืนผลตามลำดับอุปกรณ์ ลำดับไฟล์ใน ZIP จึงคงที่
+            chunksize = max(1, len(self.devices) // (self.workers * 8))
+            yield from executor.map(self.build, self.devices, chunksize=chunksize)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _write(self, archive, name, content):
+        info = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(info, content, compresslevel=self.compresslevel)
+
+    @staticmethod
+    def _minified_totals(entries):
+        sizes = [entry['minified'] for entry in entries if 'minified' in entry]
+        if not sizes:
+            return None
+        original = sum(size['original_bytes'] for size in sizes)
+        minified = sum(size['minified_bytes'] for size in sizes)
+        return {'original_bytes': original, 'minified_bytes': minified, 'saved_bytes': original - minified}
+
+    def chunks(self):
+        started = time.perf_counter()
+        sink = _ZipSink()
+        entries = []
+        with zipfile.ZipFile(sink, 'w') as archive:
+            for result in self._results():
+                files = result.pop('files')
+                for filename, content in files.items():
+                    self._write(archive, f"{result['folder']}/{filename}", content)
+                result['bytes'] = sum(len(content.encode()) for content in files.values())
+                entries.append(result)
+                data = sink.drain()
+                if data:
+                    yield data
+
+            total_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.report = {
+                'devices': len(entries),
+                'workers': self.workers,
+                'total_ms': total_ms,
+                'build_ms': round(sum(entry['build_ms'] for entry in entries), 3),
+                'minified': self._minified_totals(entries),
+                'entries': entries,
+            }
+            self._write(archive, REPORT_NAME, json.dumps(self.report, indent=2))
+        yield sink.drain()
+
+        slowest = sorted(entries, key=lambda entry: entry['build_ms'], reverse=True)[:3]
+        logger.info(f"Fleet bundle: {len(entries)} devices in {total_ms} ms "
+                    f"({self.workers or 'no'} worker processes), slowest: "
+                    + ', '.join(f"{entry['device_name']} {entry['build_ms']} ms" for entry in slowest))
@@ -0,0 +1,57 @@
+"""
+Gunicorn configuration (prefork workers x threads per worker)
+    gunicorn -c gunicorn.conf.py wsgi:app
+Graceful reload: kill -HUP <master pid>; graceful stop: kill -TERM <master pid>
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 4000)}")
+
+# One process per core is enough for I/O-bound Flask + MySQL work; threads cover
+# the time each request spends waiting on the database. Keep DB_POOL_SIZE >= threads;
+# MySQL sees up to workers x DB_POOL_SIZE connections (checked in when_ready).
+workers = int(os.environ.get('GUNICORN_WORKERS', os.environ.get('WEB_CONCURRENCY',
+                                                                multiprocessing.cpu_count())))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_class = 'gthread'  # threaded workers; each /api/esp32/stream viewer holds one thread (SSE_MAX_CLIENTS caps them)
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then to cap slow memory growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+# Importing the app does not touch MySQL, so preloading is optional; without it
+# HUP also reloads the code
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'false').lower() == 'true'
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    """บอกจำนวน MySQL connection สูงสุดที่ workers ทั้งหมดเปิดได้"""
+    from config import Config
+    pool_size = Config.DB_POOL_SIZE
+    server.log.info(f"{server.cfg.workers} workers x DB_POOL_SIZE {pool_size} = up to "
+                    f"{server.cfg.workers * pool_size} MySQL connections; keep this below max_connections")
+    if pool_size < server.cfg.threads:
+        server.log.warning(f"DB_POOL_SIZE {pool_size} is below {server.cfg.threads} threads per worker; "
+                           f"requests will wait for connections")
+
+
+def post_fork(server, worker):
+    """ไม่ใช้ connection / thread ที่ได้มาจาก master หลัง fork"""
+    import app
+    app.reset_after_fork()
+
+
+def worker_exit(server, worker):
+    """flush write-behind queue และปิด connection ก่อน worker จบการทำงาน"""
+    import app
+    app.shutdown()
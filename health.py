@@ -0,0 +1,87 @@
+"""
+Health probing helpers
+A background prober checks the database so liveness/readiness endpoints can
+answer from memory without touching MySQL on every load balancer probe
+"""
+
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HealthProbe:
+    """Runs `check()` (returns True when healthy) and remembers the outcome"""
+
+    def __init__(self, check, max_age=30):
+        self.check = check
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.healthy = False
+        self.last_checked = None
+        self.last_ok = None
+        self.latency_ms = None
+        self.consecutive_failures = 0
+        self.last_error = None
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            ok = bool(self.check())
+            error = None if ok else "check failed"
+        except Exception as e:
+            ok, error = False, str(e)
+        latency_ms = round((time.monotonic() - started) * 1000, 2)
+
+        with self._lock:
+            if ok and not self.healthy and self.last_checked is not None:
+                logger.info("Database probe recovered")
+            elif not ok and self.healthy:
+                logger.warning(f"Database probe failing: {error}")
+            self.healthy = ok
+            self.last_checked = time.time()
+            self.latency_ms = latency_ms
+            self.last_error = error
+            if ok:
+                self.last_ok = self.last_checked
+                self.consecutive_failures = 0
+            else:
+                self.consecutive_failures += 1
+        return ok
+
+    def ready(self):
+        """True if the last probe passed and is not older than max_age seconds"""
+        with self._lock:
+            return self.healthy and self.last_checked is not None and \
+                time.time() - self.last_checked <= self.max_age
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'healthy': self.healthy,
+                'last_checked': self.last_checked,
+                'last_ok': self.last_ok,
+                'age_s': round(time.time() - self.last_checked, 2) if self.last_checked else None,
+                'latency_ms': self.latency_ms,
+                'consecutive_failures': self.consecutive_failures,
+                'last_error': self.last_error,
+            }
+
+
+class RateLimiter:
+    """Allow one call per `min_interval` seconds (process-wide)"""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._last = None
+
+    def allow(self):
+        """Return (allowed, retry_after_seconds)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._last is not None and now - self._last < self.min_interval:
+                return False, self.min_interval - (now - self._last)
+            self._last = now
+            return True, 0
@@ -0,0 +1,219 @@
+"""
+Write-behind ingestion queue for ESP32 readings
+Readings are buffered in a bounded in-process queue and written to esp32_data
+in multi-row batches by a background thread
+"""
+
+import queue
+import threading
+import time
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_ENQUEUE = 'enqueue'  # ack as soon as the reading is queued
+DURABILITY_FLUSH = 'flush'      # ack only after the batch holding the reading is committed
+
+
+class PendingReading:
+    """A queued reading; wait() blocks until its batch has been written"""
+
+    __slots__ = ('data', 'received_at', 'record_id', 'error', '_done')
+
+    def __init__(self, data):
+        self.data = data
+        self.received_at = datetime.now().replace(microsecond=0)
+        self.record_id = None
+        self.error = None
+        self._done = threading.Event()
+
+    def resolve(self, record_id=None, error=None):
+        self.record_id = record_id
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+class IngestQueue:
+    """Bounded write-behind buffer flushed by size or time threshold
+
+    `writer` receives a list of readings plus the time each was received and
+    must return the list of record IDs (same order) or None on failure -
+    Database.insert_esp32_data_batch. When a multi-row write fails the batch
+    is written row by row, so one reading the database rejects is the only
+    one lost.
+    """
+
+    ROW_FAILURE_LIMIT = 3  # leading row failures that mean "database down", not "bad row"
+
+    def __init__(self, writer, max_size=10000, batch_size=500, flush_interval=1.0,
+                 max_retries=3):
+        self.writer = writer
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._rejected = 0
+        self._written = 0
+        self._dropped = 0
+        self._flushes = 0
+        self._flush_failures = 0
+        self._flush_time = 0.0
+        self._last_flush_ms = None
+        self._max_flush_ms = 0.0
+        self._last_batch_size = 0
+        self._last_flush_at = None
+
+    def start(self):
+        """Start the background writer thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='esp32-ingest-writer', daemon=True)
+        self._thread.start()
+        logger.info(f"Write-behind ingest queue started (batch {self.batch_size}, "
+                    f"interval {self.flush_interval}s, capacity {self.max_size})")
+
+    def stop(self, timeout=30):
+        """หยุด writer และ flush ข้อมูลที่ค้างอยู่ในคิวทั้งหมดลงฐานข้อมูล"""
+        if not self._thread:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error(f"Ingest queue did not drain within {timeout}s, "
+                         f"{self._queue.qsize()} readings lost")
+        else:
+            logger.info("Write-behind ingest queue flushed and stopped")
+        self._thread = None
+
+    def submit(self, data):
+        """Queue one reading; raises queue.Full when the buffer is at capacity"""
+        if self._stopping.is_set():
+            raise queue.Full("Ingest queue is shutting down")
+        pending = PendingReading(data)
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise
+        with self._lock:
+            self._enqueued += 1
+        return pending
+
+    def _take_batch(self):
+        """รอรายการแรก แล้วรวบรวมต่อจนครบ batch_size หรือหมดเวลา flush_interval"""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0 or self._stopping.is_set():
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stopping.is_set():
+                break
+
+    def _write_rows(self, readings, received_at):
+        """เขียนทีละแถวหลัง multi-row INSERT ล้มเหลว เพื่อไม่ให้แถวที่เสียแถวเดียวทำให้ทั้ง batch หาย
+
+        Returns record IDs with None for rows that failed, or None when the first
+        `ROW_FAILURE_LIMIT` rows all fail (the database is down rather than one row being bad).
+        """
+        record_ids = []
+        for index, (reading, at) in enumerate(zip(readings, received_at)):
+            written = self.writer([reading], [at])
+            record_ids.append(written[0] if written else None)
+            if index + 1 == self.ROW_FAILURE_LIMIT and not any(record_ids):
+                return None
+        return record_ids if any(record_ids) else None
+
+    def _flush(self, batch):
+        readings = [pending.data for pending in batch]
+        received_at = [pending.received_at for pending in batch]
+        record_ids = None
+        started = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            record_ids = self.writer(readings, received_at)
+            if record_ids is not None:
+                break
+            with self._lock:
+                self._flush_failures += 1
+            if len(batch) > 1:
+                record_ids = self._write_rows(readings, received_at)
+                if record_ids is not None:
+                    break
+            if attempt < self.max_retries and not self._stopping.is_set():
+                time.sleep(min(2 ** attempt * 0.5, 5))
+        elapsed_ms = (time.monotonic() - started) * 1000
+
+        if record_ids is None:
+            logger.error(f"Dropping {len(batch)} queued ESP32 readings after "
+                         f"{self.max_retries + 1} failed writes")
+            record_ids = [None] * len(batch)
+            error = "Failed to save data"
+        else:
+            error = "Reading rejected by the database"
+        rejected = 0
+        for pending, record_id in zip(batch, record_ids):
+            if record_id is None:
+                rejected += 1
+                pending.resolve(error=error)
+            else:
+                pending.resolve(record_id=record_id)
+        if rejected and rejected < len(batch):
+            logger.error(f"Dropped {rejected} ESP32 readings the database rejected, "
+                         f"saved the other {len(batch) - rejected} row by row")
+
+        with self._lock:
+            self._flushes += 1
+            self._flush_time += elapsed_ms
+            self._last_flush_ms = round(elapsed_ms, 2)
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._last_batch_size = len(batch)
+            self._last_flush_at = time.time()
+            self._dropped += rejected
+            self._written += len(batch) - rejected
+
+    def stats(self):
+        """Queue depth and flush latency metrics"""
+        with self._lock:
+            return {
+                'running': bool(self._thread and self._thread.is_alive()),
+                'depth': self._queue.qsize(),
+                'capacity': self.max_size,
+                'enqueued': self._enqueued,
+                'rejected': self._rejected,
+                'written': self._written,
+                'dropped': self._dropped,
+                'flushes': self._flushes,
+                'flush_failures': self._flush_failures,
+                'last_batch_size': self._last_batch_size,
+                'last_flush_ms': self._last_flush_ms,
+                'avg_flush_ms': round(self._flush_time / self._flushes, 2) if self._flushes else None,
+                'max_flush_ms': round(self._max_flush_ms, 2),
+                'last_flush_at': self._last_flush_at,
+            }
@@ -0,0 +1,85 @@
+"""
+In-process cache of the latest ESP32 reading per device
+Updated from Database ingest notifications, warmed from MySQL at startup and
+periodically topped up with rows written by other worker processes
+"""
+
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _position(record):
+    return (record['timestamp'], record['id'] or 0)
+
+
+class LatestReadingCache:
+    """Latest reading keyed by device_id; reads are plain dict lookups"""
+
+    def __init__(self, resync_batch=1000):
+        self.resync_batch = resync_batch
+        self._lock = threading.Lock()
+        self._by_device = {}
+        self._latest = None
+        self.max_id = 0  # highest id seen; changes whenever a reading is ingested
+        self._tail_id = None  # highest id pulled from MySQL by refresh()
+        self.warmed = False
+
+    def update(self, records):
+        """Apply new readings, keeping only the newest (timestamp, id) per device"""
+        with self._lock:
+            for record in records:
+                if record['id'] and record['id'] > self.max_id:
+                    self.max_id = record['id']
+                current = self._by_device.get(record['device_id'])
+                if current is None or _position(record) >= _position(current):
+                    self._by_device[record['device_id']] = record
+                    if self._latest is None or _position(record) >= _position(self._latest):
+                        self._latest = record
+
+    def get(self, device_id):
+        return self._by_device.get(device_id)
+
+    def latest(self):
+        return self._latest
+
+    def all(self):
+        return dict(self._by_device)
+
+    def refresh(self, db, on_rows=None):
+        """โหลดข้อมูลล่าสุดของทุกอุปกรณ์ครั้งแรก แล้วดึงเฉพาะแถวใหม่ (id > tail) ในรอบถัดไป
+
+        ทำให้ข้อมูลที่ worker process อื่นบันทึกมาปรากฏใน cache นี้ภายในหนึ่งรอบ
+        on_rows(rows) ถูกเรียกกับแถวใหม่แต่ละชุดที่ดึงมา (ไม่รวมตอน warm)
+        """
+        if not self.warmed:
+            rows = db.get_latest_esp32_per_device()
+            if rows is None:
+                return None
+            self.update(rows)
+            self._tail_id = max((row['id'] for row in rows), default=0)
+            self.warmed = True
+            logger.info(f"Latest reading cache warmed with {len(rows)} devices")
+            return len(rows)
+
+        total = 0
+        while True:
+            rows = db.get_esp32_data_after_id(self._tail_id, self.resync_batch)
+            if not rows:
+                return total
+            self.update(rows)
+            if on_rows:
+                on_rows(rows)
+            self._tail_id = rows[-1]['id']
+            total += len(rows)
+            if len(rows) < self.resync_batch:
+                return total
+
+    def stats(self):
+        return {
+            'warmed': self.warmed,
+            'devices': len(self._by_device),
+            'max_id': self.max_id,
+            'tail_id': self._tail_id,
+        }
@@ -0,0 +1,117 @@
+"""
+Live ESP32 reading stream (Server-Sent Events)
+Each ingested reading is encoded once and fanned out to every connected viewer
+through a small per-viewer buffer, so viewers never query the database
+"""
+
+import json
+import queue
+import threading
+from collections import deque
+import logging
+
+logger = logging.getLogger(__name__)
+
+STREAM_FIELDS = ('id', 'device_id', 'temperature', 'humidity', 'light', 'timestamp')
+
+
+def encode_event(record):
+    """Format one reading as an SSE `reading` event"""
+    payload = {field: record.get(field) for field in STREAM_FIELDS}
+    if payload['timestamp'] is not None:
+        payload['timestamp'] = payload['timestamp'].isoformat()
+    return f"id: {record['id']}\nevent: reading\ndata: {json.dumps(payload)}\n\n"
+
+
+class Subscription:
+    """One connected viewer; `device_id=None` receives every device"""
+
+    def __init__(self, device_id, buffer_size):
+        self.device_id = device_id
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.closed = False
+
+    def events(self, heartbeat=15):
+        """Yield encoded events, or a comment line every `heartbeat` seconds of silence
+
+        The heartbeat also lets the server notice viewers that have gone away.
+        """
+        while not self.closed:
+            try:
+                event = self.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if event is None:
+                break
+            yield event
+
+
+class LiveBroadcaster:
+    """Fan-out of ingest notifications to SSE subscribers"""
+
+    def __init__(self, max_clients=100, client_buffer=500, recent_ids=10000):
+        self.max_clients = max_clients
+        self.client_buffer = client_buffer
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        # ids already published; the same row can arrive from ingest and from the resync tail
+        self._recent = deque(maxlen=recent_ids)
+        self._recent_set = set()
+        self._published = 0
+        self._dropped_clients = 0
+
+    def subscribe(self, device_id=None):
+        """Register a viewer; returns None when max_clients are already connected"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            subscription = Subscription(device_id, self.client_buffer)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        subscription.closed = True
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _seen(self, record_id):
+        if record_id in self._recent_set:
+            return True
+        if len(self._recent) == self._recent.maxlen:
+            self._recent_set.discard(self._recent[0])
+        self._recent.append(record_id)
+        self._recent_set.add(record_id)
+        return False
+
+    def publish(self, records):
+        """Ingest listener: encode each new reading once and queue it for matching viewers"""
+        with self._lock:
+            events = [(record['device_id'], encode_event(record))
+                      for record in records
+                      if record['id'] is not None and not self._seen(record['id'])]
+            if not events:
+                return
+            self._published += len(events)
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            try:
+                for device_id, event in events:
+                    if subscription.device_id is None or subscription.device_id == device_id:
+                        subscription.queue.put_nowait(event)
+            except queue.Full:
+                # viewer ตามไม่ทัน ตัดการเชื่อมต่อให้ browser reconnect ใหม่เอง
+                logger.warning("Dropping slow live stream viewer (buffer full)")
+                self.unsubscribe(subscription)
+                with self._lock:
+                    self._dropped_clients += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._subscribers),
+                'max_clients': self.max_clients,
+                'published': self._published,
+                'dropped_clients': self._dropped_clients,
+            }
@@ -0,0 +1,214 @@
+"""
+Database schema migrations
+Ordered, idempotent schema steps; applied ones are recorded in schema_migrations.
+Run pending migrations with `flask --app app migrate`.
+
+Each step spells out its own DDL instead of reusing constants from database.py,
+so an applied migration keeps meaning the same thing when the code changes.
+"""
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register `func(cursor)` as schema migration `version`"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+
+def column_exists(cursor, table, column):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    return cursor.fetchone() is not None
+
+
+def index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        LIMIT 1
+    """, (table, index))
+    return cursor.fetchone() is not None
+
+
+def add_column(cursor, table, column, definition):
+    """ALTER TABLE ... ADD COLUMN เฉพาะเมื่อยังไม่มี column นี้ (MySQL ไม่มี ADD COLUMN IF NOT EXISTS)"""
+    if not column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def add_index(cursor, table, index, definition):
+    if not index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} ADD {definition}")
+
+
+@migration(1, "Core tables: users, esp32_data")
+def create_core_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            email VARCHAR(100) UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS esp32_data (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            device_id VARCHAR(100) DEFAULT 'ESP32_DEFAULT',
+            temperature FLOAT,
+            humidity FLOAT,
+            light FLOAT,
+            raw_data JSON,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_device_timestamp (device_id, timestamp),
+            INDEX idx_timestamp (timestamp)
+        )
+    """)
+
+
+@migration(2, "Device management tables: esp32_devices, program_templates")
+def create_device_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS esp32_devices (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            device_name VARCHAR(100) NOT NULL UNIQUE,
+            device_type ENUM('ESP32', 'PICO_WH', 'ESP8266') DEFAULT 'ESP32',
+            description TEXT,
+            wifi_ssid VARCHAR(100),
+            wifi_password VARCHAR(100),
+            pin_config JSON,
+            sensor_config JSON,
+            program_template VARCHAR(50) DEFAULT 'basic_sensor',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS program_templates (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            template_name VARCHAR(100) NOT NULL UNIQUE,
+            template_type ENUM('ESP32', 'PICO_WH', 'ESP8266') DEFAULT 'ESP32',
+            description TEXT,
+            code_template LONGTEXT,
+            required_libraries JSON,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+
+
+@migration(3, "Per-table change counters: table_versions")
+def create_table_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name VARCHAR(64) PRIMARY KEY,
+            version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+
+
+@migration(4, "ESP32 rollup tables (1m / 1h / 1d) and rollup watermark")
+def create_rollup_tables(cursor):
+    metric_columns = "".join(f"""
+            {metric}_count INT UNSIGNED NOT NULL DEFAULT 0,
+            {metric}_sum DOUBLE,
+            {metric}_min FLOAT,
+            {metric}_max FLOAT,""" for metric in ('temperature', 'humidity', 'light'))
+    for suffix in ('1m', '1h', '1d'):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS esp32_rollup_{suffix} (
+                device_id VARCHAR(100) NOT NULL,
+                bucket INT UNSIGNED NOT NULL,
+                count INT UNSIGNED NOT NULL DEFAULT 0,{metric_columns}
+                PRIMARY KEY (device_id, bucket),
+                INDEX idx_bucket (bucket)
+            )
+        """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS esp32_rollup_state (
+            name VARCHAR(50) PRIMARY KEY,
+            last_id BIGINT NOT NULL DEFAULT 0,
+            seen_max_id BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("INSERT IGNORE INTO esp32_rollup_state (name) VALUES ('esp32_data')")
+
+
+@migration(5, "Tables used by the app but never created: user_data, esp32_programs")
+def create_user_data_and_programs(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_data (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            data_input TEXT NOT NULL,
+            ip_address VARCHAR(45),
+            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_submitted_at (submitted_at)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS esp32_programs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            program_name VARCHAR(100) NOT NULL,
+            description TEXT,
+            program_code LONGTEXT,
+            version VARCHAR(20) DEFAULT '1.0.0',
+            created_by VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            INDEX idx_created_at (created_at)
+        )
+    """)
+
+
+@migration(6, "esp32_devices columns used by the ESP32 device API: device_id, location, program_code, last_seen")
+def add_esp32_device_columns(cursor):
+    add_column(cursor, 'esp32_devices', 'device_id', "VARCHAR(100) NULL AFTER id")
+    add_column(cursor, 'esp32_devices', 'location', "VARCHAR(200) DEFAULT ''")
+    add_column(cursor, 'esp32_devices', 'program_code', "LONGTEXT")
+    add_column(cursor, 'esp32_devices', 'last_seen', "TIMESTAMP NULL")
+    add_index(cursor, 'esp32_devices', 'uq_device_id', "UNIQUE INDEX uq_device_id (device_id)")
+
+
+@migration(7, "Triggers that bump table_versions on any program_templates change")
+def add_program_template_version_triggers(cursor):
+    # แก้ template ด้วย SQL ตรงๆ ก็ทำให้ทุก worker โหลด template ใหม่ (TemplateLibrary ดู version นี้)
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        name = f"trg_program_templates_{event.lower()}_version"
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"""
+            CREATE TRIGGER {name} AFTER {event} ON program_templates
+            FOR EACH ROW
+                INSERT INTO table_versions (table_name, version) VALUES ('program_templates', 1)
+                ON DUPLICATE KEY UPDATE version = version + 1
+        """)
+
+
+@migration(8, "Backfill esp32_data.device_id from raw_data.sensor_id")
+def backfill_esp32_device_ids(cursor, batch_size=10000):
+    # เดินตาม primary key ทีละช่วงและ commit ทุกช่วง ไม่ล็อกทั้งตารางนาน (เหมือน backfill-device-ids)
+    cursor.execute("SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM esp32_data")
+    bounds = cursor.fetchone()
+    if bounds['min_id'] is None:
+        return
+    for start in range(bounds['min_id'] - 1, bounds['max_id'], batch_size):
+        cursor.execute("""
+            UPDATE esp32_data
+            SET device_id = LEFT(TRIM(JSON_UNQUOTE(JSON_EXTRACT(raw_data, '$.sensor_id'))), 100)
+            WHERE id > %s AND id <= %s
+              AND (device_id IS NULL OR device_id = 'ESP32_DEFAULT')
+              AND JSON_TYPE(JSON_EXTRACT(raw_data, '$.sensor_id')) NOT IN ('NULL', 'OBJECT', 'ARRAY')
+              AND TRIM(JSON_UNQUOTE(JSON_EXTRACT(raw_data, '$.sensor_id'))) <> ''
+        """, (start, start + batch_size))
+        cursor.connection.commit()
+
+
+MIGRATIONS.sort(key=lambda entry: entry[0])
+LATEST_VERSION = MIGRATIONS[-1][0]
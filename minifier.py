@@ -0,0 +1,133 @@
+"""
+MicroPython source minifier for generated firmware
+Strips comments, docstrings and blank lines, re-indents with one space per
+level and can drop print() diagnostics, so uploads over serial are shorter
+and the board needs less RAM to compile main.py on import.
+Works on tokens and copies every kept token from the source verbatim, so
+strings (including f-strings) are never rewritten.
+"""
+
+import io
+import tokenize
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bump when the output changes, so stored minified artifacts are not reused
+MINIFY_VERSION = 1
+
+_SKIP = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING}
+_FSTRING_START = getattr(tokenize, 'FSTRING_START', None)  # Python 3.12+
+_FSTRING_END = getattr(tokenize, 'FSTRING_END', None)
+
+
+def _is_docstring(statement):
+    """A statement made only of string literals (docstring or stray string) does nothing"""
+    return all(token.type == tokenize.STRING for token in statement)
+
+
+def _is_print(statement):
+    """print(...) as a whole statement"""
+    if len(statement) < 3 or statement[0].string != 'print' or statement[1].string != '(':
+        return False
+    depth = 0
+    for index, token in enumerate(statement[1:], 1):
+        if token.type == tokenize.OP and token.string in '([{':
+            depth += 1
+        elif token.type == tokenize.OP and token.string in ')]}':
+            depth -= 1
+            if depth == 0:
+                return index == len(statement) - 1
+    return False
+
+
+def _statement_text(lines, statement):
+    """Source text of a logical line without comments, joining continuation lines with a space"""
+    def text(start, end):
+        if start[0] == end[0]:
+            return lines[start[0] - 1][start[1]:end[1]]
+        return ''.join([lines[start[0] - 1][start[1]:]]
+                       + lines[start[0]:end[0] - 1]
+                       + [lines[end[0] - 1][:end[1]]])
+
+    parts = []
+    fstring_depth = 0
+    previous = None
+    for token in statement:
+        if previous is not None:
+            if previous.end[0] == token.start[0] or fstring_depth:
+                parts.append(text(previous.end, token.start))
+            else:
+                # ต่อบรรทัด (ในวงเล็บหรือด้วย \) ด้วยช่องว่างเดียว
+                parts.append(' ')
+        parts.append(text(token.start, token.end))
+        if token.type == _FSTRING_START:
+            fstring_depth += 1
+        elif token.type == _FSTRING_END:
+            fstring_depth -= 1
+        previous = token
+    return ''.join(parts)
+
+
+def minify_source(source, strip_prints=False):
+    """Return minified source; raises tokenize.TokenError / SyntaxError on invalid input"""
+    lines = source.splitlines(keepends=True)
+    tokens = tokenize.generate_tokens(io.StringIO(source).readline)
+
+    output = []
+    depth = 0
+    block_used = [True]  # per indentation level: has the block kept a statement yet
+    statement = []
+
+    for token in tokens:
+        if token.type in _SKIP:
+            continue
+        if token.type == tokenize.INDENT:
+            depth += 1
+            block_used.append(False)
+            continue
+        if token.type == tokenize.DEDENT:
+            if not block_used.pop():
+                output.append(' ' * depth + 'pass\n')
+            depth -= 1
+            continue
+        if token.type == tokenize.ENDMARKER:
+            break
+        if token.type != tokenize.NEWLINE:
+            statement.append(token)
+            continue
+
+        if statement and not _is_docstring(statement) and \
+                not (strip_prints and _is_print(statement)):
+            output.append(' ' * depth + _statement_text(lines, statement) + '\n')
+            block_used[-1] = True
+        statement = []
+
+    return ''.join(output)
+
+
+def size_report(original, minified):
+    """Byte sizes before / after minification"""
+    original_bytes = len(original.encode('utf-8'))
+    minified_bytes = len(minified.encode('utf-8'))
+    return {
+        'original_bytes': original_bytes,
+        'minified_bytes': minified_bytes,
+        'saved_bytes': original_bytes - minified_bytes,
+        'ratio': round(minified_bytes / original_bytes, 3) if original_bytes else 1.0,
+    }
+
+
+def minify(source, strip_prints=False):
+    """Minify generated code and report the sizes
+
+    Returns (code, report). If the source cannot be tokenized or the result
+    does not compile, the original code is returned unchanged.
+    """
+    try:
+        code = minify_source(source, strip_prints)
+        compile(code, '<minified>', 'exec')
+    except (SyntaxError, tokenize.TokenError, IndentationError) as e:
+        logger.warning(f"Minify failed, keeping original code: {e}")
+        code = source
+    return code, size_report(source, code)
@@ -0,0 +1,64 @@
+"""
+Cached database statistics
+Counters are bumped on ingest and reconciled with MySQL in the background,
+so reading stats never runs COUNT(*) on the request path
+"""
+
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATS_MODE_EXACT = 'exact'              # background SELECT COUNT(*)
+STATS_MODE_APPROXIMATE = 'approximate'  # information_schema.TABLES row estimates
+
+
+class DatabaseStatsCache:
+    """Constant-time database stats: esp32_count, user_data_count, last_esp32_data"""
+
+    def __init__(self, mode=STATS_MODE_EXACT):
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.refreshed_at = None
+
+    @property
+    def warmed(self):
+        return self.refreshed_at is not None
+
+    def on_esp32_ingest(self, records):
+        """Ingest listener: นับข้อมูลใหม่และอัพเดทเวลาข้อมูลล่าสุด"""
+        newest = max(record['timestamp'] for record in records)
+        with self._lock:
+            self._stats['esp32_count'] = self._stats.get('esp32_count', 0) + len(records)
+            last = self._stats.get('last_esp32_data')
+            if last is None or newest > last:
+                self._stats['last_esp32_data'] = newest
+
+    def on_user_data_insert(self, count=1):
+        with self._lock:
+            self._stats['user_data_count'] = self._stats.get('user_data_count', 0) + count
+
+    def refresh(self, db):
+        """อ่านค่าจริงจากฐานข้อมูล (เรียกจาก background task ทุก TTL)"""
+        if self.mode == STATS_MODE_APPROXIMATE:
+            stats = db.get_approximate_database_stats()
+        else:
+            stats = db.get_database_stats()
+        if not stats:
+            return None
+        with self._lock:
+            self._stats = dict(stats)
+            self.refreshed_at = time.time()
+        return stats
+
+    def get(self):
+        """Snapshot of the cached stats (empty until the first refresh)"""
+        with self._lock:
+            if not self.warmed:
+                return {}
+            stats = dict(self._stats)
+        stats['approximate'] = self.mode == STATS_MODE_APPROXIMATE
+        stats['refreshed_at'] = self.refreshed_at
+        return stats
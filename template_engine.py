@@ -0,0 +1,228 @@
+"""
+Template engine for generated device code
+Templates are plain MicroPython with {{ name }} / {{ pin_config.led_pin }} placeholders.
+Each source is compiled once into a str.format pattern plus value getters, so
+rendering a device config is only the substitution.
+Sources: program_templates rows with a code_template, then the built-in files
+in firmware_templates/ (<device_type>/<template_name>.py.tmpl).
+"""
+
+import hashlib
+import operator
+import os
+import re
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'firmware_templates')
+TEMPLATE_SUFFIX = '.py.tmpl'
+UPLOADER_TEMPLATE = 'uploader'
+
+PLACEHOLDER = re.compile(r'\{\{\s*([A-Za-z_]\w*(?:\.\w+)*)\s*\}\}')
+
+# Top-level names a template may reference (dotted paths go into pin_config / sensor_config)
+TEMPLATE_FIELDS = ('device_name', 'device_type', 'wifi_ssid', 'wifi_password', 'pin_config',
+                   'sensor_config', 'led_pin', 'temp_pin', 'light_pin', 'generator_version',
+                   'code_content')
+
+# Variants that have no template of their own render the basic one
+TEMPLATE_ALIASES = {'advanced_iot': 'basic_sensor', 'relay_control': 'basic_sensor'}
+DEFAULT_DEVICE_TYPE = 'ESP32'
+DEFAULT_TEMPLATE = 'basic_sensor'
+
+
+class TemplateError(Exception):
+    """Raised for a template that does not compile or cannot be rendered"""
+
+
+def _getter(path):
+    keys = path.split('.')
+    if len(keys) == 1:
+        return operator.itemgetter(path)
+
+    def get(context):
+        value = context
+        for key in keys:
+            value = value[key]
+        return value
+    return get
+
+
+class CompiledTemplate:
+    """A template parsed once; render(context) only fills in the values"""
+
+    __slots__ = ('name', 'digest', 'fields', '_pattern', '_getters')
+
+    def __init__(self, name, source):
+        self.name = name
+        self.digest = hashlib.sha256(source.encode()).hexdigest()
+
+        pattern, fields, position = [], [], 0
+        for match in PLACEHOLDER.finditer(source):
+            path = match.group(1)
+            if path.split('.')[0] not in TEMPLATE_FIELDS:
+                raise TemplateError(f"Template '{name}' uses unknown field '{path}'")
+            pattern.append(source[position:match.start()].replace('{', '{{').replace('}', '}}'))
+            pattern.append(f'{{{len(fields)}}}')
+            fields.append(path)
+            position = match.end()
+        pattern.append(source[position:].replace('{', '{{').replace('}', '}}'))
+
+        self.fields = tuple(fields)
+        self._pattern = ''.join(pattern)
+        self._getters = [_getter(path) for path in fields]
+
+    def render(self, context):
+        try:
+            values = [get(context) for get in self._getters]
+        except (KeyError, TypeError) as e:
+            raise TemplateError(f"Template '{self.name}' has no value for {e}")
+        return self._pattern.format(*values)
+
+
+class TemplateLibrary:
+    """Compiled templates keyed by (device_type, template_name)
+
+    A program_templates row with a code_template overrides the file of the same
+    device type and name. The table is re-read when invalidate() was called
+    (local write) or its table_versions counter moved (checked at most every
+    `check_interval` seconds). Compiled templates are kept by source digest,
+    so a reload only compiles rows whose text actually changed.
+    Without `db`, a fixed set of `rows` (from export_rows()) can be given instead.
+    """
+
+    def __init__(self, db=None, directory=TEMPLATE_DIR, check_interval=5, rows=None):
+        self.db = db
+        self.directory = directory
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._files = None
+        self._compiled = {}  # digest -> CompiledTemplate
+        self.version = None
+        self._checked_at = 0.0
+        self._generation = 0
+        self._stale = db is not None
+        self.compiles = 0
+        self.loads = 0
+        self._source_rows = list(rows or ())
+        self._rows = self._compile_rows(self._source_rows)
+
+    def invalidate(self):
+        """Template listener: re-read program_templates on next use"""
+        with self._lock:
+            self._generation += 1
+            self._stale = True
+
+    def compile(self, name, source):
+        """Compile `source`, reusing the compiled form of identical text"""
+        digest = hashlib.sha256(source.encode()).hexdigest()
+        template = self._compiled.get(digest)
+        if template is None:
+            template = CompiledTemplate(name, source)
+            self._compiled[digest] = template
+            self.compiles += 1
+        return template
+
+    def _load_files(self):
+        files = {}
+        for root, _, names in os.walk(self.directory):
+            device_type = os.path.relpath(root, self.directory)
+            device_type = None if device_type == '.' else device_type.upper()
+            for filename in names:
+                if not filename.endswith(TEMPLATE_SUFFIX):
+                    continue
+                name = filename[:-len(TEMPLATE_SUFFIX)]
+                with open(os.path.join(root, filename), encoding='utf-8') as f:
+                    files[(device_type, name)] = self.compile(filename, f.read())
+        logger.info(f"Loaded {len(files)} built-in code templates from {self.directory}")
+        return files
+
+    def _load_rows(self):
+        """อ่าน program_templates ใหม่เมื่อถูก invalidate หรือ version ในฐานข้อมูลเปลี่ยน"""
+        with self._lock:
+            if not self._stale and time.monotonic() - self._checked_at < self.check_interval:
+                return self._rows
+            generation = self._generation
+            stale = self._stale
+
+        if not stale:
+            current = self.db.get_table_version('program_templates')
+            if current is not None and current[0] == self.version:
+                with self._lock:
+                    self._checked_at = time.monotonic()
+                return self._rows
+
+        loaded = self.db.load_program_templates()
+        if loaded is None:
+            # ฐานข้อมูลมีปัญหา ใช้ template ชุดเดิมไปก่อน
+            return self._rows
+        version, rows = loaded
+        templates = self._compile_rows(rows)
+
+        with self._lock:
+            self._rows = templates
+            self._source_rows = rows
+            self.version = version
+            self._checked_at = time.monotonic()
+            self._stale = generation != self._generation
+            self.loads += 1
+        logger.info(f"Loaded {len(templates)} code templates from program_templates (version {version})")
+        return templates
+
+    def _compile_rows(self, rows):
+        templates = {}
+        for row in rows:
+            if not row.get('code_template'):
+                continue
+            device_type = row['template_type']
+            name = row['template_name']
+            # ชื่อแบบ basic_sensor_esp32 (จาก setup_device_tables.py) ใช้ได้เหมือน basic_sensor
+            suffix = f"_{device_type.lower()}"
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+            try:
+                templates[(device_type, name)] = self.compile(row['template_name'], row['code_template'])
+            except TemplateError as e:
+                logger.error(f"Skipping program template {row['id']}: {e}")
+        return templates
+
+    def get(self, device_type, template_name):
+        """Template for a device, falling back to the alias and then ESP32 basic_sensor"""
+        if self._files is None:
+            self._files = self._load_files()
+        rows = self._load_rows() if self.db is not None else self._rows
+
+        candidates = [(device_type, template_name)]
+        if template_name in TEMPLATE_ALIASES:
+            candidates.append((device_type, TEMPLATE_ALIASES[template_name]))
+        candidates.append((DEFAULT_DEVICE_TYPE, DEFAULT_TEMPLATE))
+        for key in candidates:
+            template = rows.get(key) or self._files.get(key)
+            if template is not None:
+                return template
+        raise TemplateError(f"No code template for {device_type}/{template_name}")
+
+    def export_rows(self):
+        """Current program_templates rows, for building a TemplateLibrary(rows=...) elsewhere"""
+        if self.db is not None:
+            self._load_rows()
+        return list(self._source_rows)
+
+    def uploader(self):
+        if self._files is None:
+            self._files = self._load_files()
+        return self._files[(None, UPLOADER_TEMPLATE)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._files or ()),
+                'rows': len(self._rows),
+                'version': self.version,
+                'compiled': len(self._compiled),
+                'compiles': self.compiles,
+                'loads': self.loads,
+            }
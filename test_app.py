@@ -6,9 +6,14 @@ Tests all API endpoints and functionality
 
 import requests
 import json
+import os
+import subprocess
+import sys
 import time
 import random
-from datetime import datetime
+import io
+import zipfile
+from datetime import datetime, timedelta
 
 # Configuration
 BASE_URL = "http://localhost:4000"
@@ -53,6 +58,36 @@ def test_esp32_data_post():
         print(f"❌ ESP32 POST failed: {e}")
         return False
 
+def test_esp32_batch_post():
+    """Test posting a batch of ESP32 readings"""
+    print("\n📦 Testing ESP32 Batch POST...")
+    
+    readings = [
+        {
+            "temperature": round(random.uniform(20.0, 35.0), 1),
+            "humidity": round(random.uniform(40.0, 80.0), 1),
+            "light": round(random.uniform(0, 1000), 1),
+            "device_id": f"ESP32_GATEWAY_{i:02d}"
+        }
+        for i in range(20)
+    ]
+    readings.append({"temperature": "not-a-number"})  # should be rejected on its own
+    
+    try:
+        response = requests.post(
+            f"{BASE_URL}/api/esp32/data/batch",
+            headers=API_HEADERS,
+            json={"readings": readings}
+        )
+        data = response.json()
+        print(f"Status: {response.status_code}")
+        print(f"Inserted: {data.get('inserted')}/{data.get('received')} "
+              f"(IDs {data.get('first_id')}-{data.get('last_id')})")
+        return response.status_code == 200 and data.get('inserted') == 20 and data.get('failed') == 1
+    except Exception as e:
+        print(f"❌ ESP32 batch POST failed: {e}")
+        return False
+
 def test_esp32_data_get():
     """Test getting ESP32 data"""
     print("\n📊 Testing ESP32 Data GET...")
@@ -67,6 +102,25 @@ def test_esp32_data_get():
         print(f"❌ ESP32 GET failed: {e}")
         return False
 
+def test_esp32_pagination():
+    """Test paging through ESP32 data with cursors"""
+    print("\n📄 Testing ESP32 Data Pagination...")
+    try:
+        first = requests.get(f"{BASE_URL}/api/esp32/data?limit=5").json()
+        cursor = first.get('next_cursor')
+        print(f"Page 1: {first.get('count')} records, next_cursor={cursor}")
+        if not cursor:
+            return first.get('status') == 'success'
+        
+        second = requests.get(f"{BASE_URL}/api/esp32/data?limit=5&before={cursor}").json()
+        print(f"Page 2: {second.get('count')} records")
+        first_ids = {row['id'] for row in first['data']}
+        overlap = first_ids & {row['id'] for row in second.get('data', [])}
+        return second.get('status') == 'success' and not overlap
+    except Exception as e:
+        print(f"❌ ESP32 pagination failed: {e}")
+        return False
+
 def test_esp32_latest():
     """Test getting latest ESP32 data"""
     print("\n🔥 Testing Latest ESP32 Data...")
@@ -79,6 +133,58 @@ def test_esp32_latest():
         print(f"❌ ESP32 Latest failed: {e}")
         return False
 
+def test_esp32_series_unaligned():
+    """Test that a series starting off a rollup boundary matches the raw data path"""
+    print("\n📈 Testing ESP32 Series With Unaligned Start...")
+    try:
+        # bucket=1h อ่านจาก rollup, bucket=59s (ไม่ใช่ผลคูณของ 60) อ่านจากแถวดิบเสมอ
+        end = datetime.now().replace(microsecond=0)
+        start = end.replace(minute=30, second=17) - timedelta(days=1)
+        params = {'from': start.isoformat(), 'to': end.isoformat()}
+        rollup = requests.get(f"{BASE_URL}/api/esp32/series", params={**params, 'bucket': '1h'}).json()
+        raw = requests.get(f"{BASE_URL}/api/esp32/series", params={**params, 'bucket': '59s'}).json()
+        
+        def totals(series):
+            points = series.get('points', [])
+            temperatures = [point['temperature_max'] for point in points if point['temperature_max'] is not None]
+            return sum(point['count'] for point in points), max(temperatures, default=None)
+        
+        print(f"Rollup path: {totals(rollup)}, raw path: {totals(raw)}")
+        return (rollup.get('status') == 'success' and raw.get('status') == 'success'
+                and totals(rollup) == totals(raw))
+    except Exception as e:
+        print(f"❌ ESP32 series comparison failed: {e}")
+        return False
+
+STARTUP_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - started) * 1000
+client = app.create_app({'TESTING': True}).test_client()
+started = time.perf_counter()
+client.get('/api/health/live')
+first_request_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({'import_ms': import_ms, 'first_request_ms': first_request_ms,
+                  'budget_ms': app.app.config['STARTUP_BUDGET_MS']}))
+"""
+
+def test_startup_budget():
+    """Test that importing the app and serving the first request stay within STARTUP_BUDGET_MS"""
+    print("\n⏱️ Testing Startup Budget...")
+    try:
+        # fresh interpreter so nothing is already imported or warmed up
+        result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True,
+                                text=True, timeout=60, cwd=os.path.dirname(os.path.abspath(__file__)))
+        metrics = json.loads(result.stdout.strip().splitlines()[-1])
+        total = metrics['import_ms'] + metrics['first_request_ms']
+        print(f"Import: {metrics['import_ms']:.1f}ms, first request: {metrics['first_request_ms']:.1f}ms "
+              f"(budget {metrics['budget_ms']}ms)")
+        return total <= metrics['budget_ms']
+    except Exception as e:
+        print(f"❌ Startup budget check failed: {e}")
+        return False
+
 def send_multiple_test_data(count=5):
     """Send multiple test records"""
     print(f"\n🚀 Sending {count} test records...")
@@ -139,6 +245,118 @@ def test_web_pages():
     
     return success_count == len(pages)
 
+def first_device_id():
+    """id ของอุปกรณ์ตัวแรกจาก /api/devices (None ถ้ายังไม่มีอุปกรณ์)"""
+    devices = requests.get(f"{BASE_URL}/api/devices").json().get('devices', [])
+    return devices[0]['id'] if devices else None
+
+def test_device_code_not_modified():
+    """Test that generated code answers 304 when If-None-Match still matches"""
+    print("\n🏷️  Testing Generated Code ETag...")
+    try:
+        device_id = first_device_id()
+        if device_id is None:
+            print("No devices registered, skipping")
+            return True
+        
+        first = requests.get(f"{BASE_URL}/api/devices/{device_id}/code")
+        etag = first.headers.get('ETag')
+        print(f"Status: {first.status_code}, ETag: {etag}")
+        second = requests.get(f"{BASE_URL}/api/devices/{device_id}/code",
+                              headers={'If-None-Match': etag or ''})
+        print(f"Revalidation status: {second.status_code}")
+        return first.status_code == 200 and etag is not None and second.status_code == 304
+    except Exception as e:
+        print(f"❌ Generated code ETag failed: {e}")
+        return False
+
+def test_device_code_minify():
+    """Test that ?minify=1 returns smaller code that still compiles"""
+    print("\n🗜️  Testing Minified Device Code...")
+    try:
+        device_id = first_device_id()
+        if device_id is None:
+            print("No devices registered, skipping")
+            return True
+        
+        response = requests.get(f"{BASE_URL}/api/devices/{device_id}/code?minify=1")
+        data = response.json()
+        print(f"Status: {response.status_code}, sizes: {data.get('minified')}")
+        compile(data['code'], 'main.py', 'exec')
+        return response.status_code == 200 and 'minified' in data
+    except Exception as e:
+        print(f"❌ Minified code failed: {e}")
+        return False
+
+def test_device_code_range():
+    """Test resuming a code download with a Range request"""
+    print("\n✂️  Testing Device Code Range Download...")
+    try:
+        device_id = first_device_id()
+        if device_id is None:
+            print("No devices registered, skipping")
+            return True
+        
+        full = requests.get(f"{BASE_URL}/devices/{device_id}/download",
+                            headers={'Accept-Encoding': 'identity'})
+        partial = requests.get(f"{BASE_URL}/devices/{device_id}/download",
+                               headers={'Range': 'bytes=0-99', 'Accept-Encoding': 'identity'})
+        print(f"Status: {partial.status_code}, Content-Range: {partial.headers.get('Content-Range')}")
+        return (full.status_code == 200 and partial.status_code == 206
+                and partial.content == full.content[:100])
+    except Exception as e:
+        print(f"❌ Range download failed: {e}")
+        return False
+
+def test_fleet_bundle():
+    """Test the fleet bundle ZIP and its build report"""
+    print("\n📦 Testing Fleet Bundle...")
+    try:
+        device_id = first_device_id()
+        if device_id is None:
+            print("No devices registered, skipping")
+            return True
+        
+        response = requests.get(f"{BASE_URL}/api/devices/bundle?ids={device_id}")
+        print(f"Status: {response.status_code}, {len(response.content)} bytes")
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            names = archive.namelist()
+            report = json.loads(archive.read('build_report.json'))
+        print(f"Files: {names}")
+        return (response.status_code == 200 and report['devices'] == 1
+                and any(name.endswith('/main.py') for name in names))
+    except Exception as e:
+        print(f"❌ Fleet bundle failed: {e}")
+        return False
+
+def run_load_test(path="/api/health/live", concurrency=16, total=2000):
+    """Simple load test: `total` GETs from `concurrency` threads, prints throughput and latency"""
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+    
+    print(f"\n🏋️ Load test: GET {path} x{total}, concurrency {concurrency}")
+    local = threading.local()
+    
+    def timed_get(_):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        response = local.session.get(f"{BASE_URL}{path}")
+        return response.status_code, (time.perf_counter() - started) * 1000
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed_get, range(total)))
+    elapsed = time.perf_counter() - started
+    
+    latencies = sorted(latency for _, latency in results)
+    errors = sum(1 for status, _ in results if status >= 500)
+    print(f"Throughput: {total / elapsed:.0f} req/s, errors: {errors}")
+    print(f"Latency p50: {latencies[len(latencies) // 2]:.1f}ms, "
+          f"p95: {latencies[int(len(latencies) * 0.95)]:.1f}ms, "
+          f"p99: {latencies[int(len(latencies) * 0.99)]:.1f}ms")
+    return total / elapsed
+
 def run_comprehensive_test():
     """Run all tests"""
     print("🧪 Starting Comprehensive IoT Flask App Test")
@@ -149,9 +367,17 @@ def run_comprehensive_test():
     # Run individual tests
     results['health'] = test_health_check()
     results['esp32_post'] = test_esp32_data_post()
+    results['esp32_batch'] = test_esp32_batch_post()
     results['esp32_get'] = test_esp32_data_get()
+    results['esp32_pagination'] = test_esp32_pagination()
     results['esp32_latest'] = test_esp32_latest()
+    results['esp32_series_unaligned'] = test_esp32_series_unaligned()
     results['web_pages'] = test_web_pages()
+    results['device_code_etag'] = test_device_code_not_modified()
+    results['device_code_minify'] = test_device_code_minify()
+    results['device_code_range'] = test_device_code_range()
+    results['fleet_bundle'] = test_fleet_bundle()
+    results['startup_budget'] = test_startup_budget()
     
     # Send multiple test data
     sent_count = send_multiple_test_data(10)
@@ -183,4 +409,11 @@ def run_comprehensive_test():
     return passed == total
 
 if __name__ == "__main__":
-    run_comprehensive_test()
+    if len(sys.argv) > 1 and sys.argv[1] == "--load":
+        # python test_app.py --load [path] [concurrency] [total]
+        args = sys.argv[2:]
+        run_load_test(args[0] if args else "/api/health/live",
+                      int(args[1]) if len(args) > 1 else 16,
+                      int(args[2]) if len(args) > 2 else 2000)
+    else:
+        run_comprehensive_test()